@@ -1,5 +1,7 @@
 from operator import le, lt
 
+import numpy as np
+
 class CustomColors:
     """
     A little smarter colormap than the linear model offered in bokeh.
@@ -19,6 +21,9 @@ class CustomColors:
     when the value is equal to a tick, then 'side' determines
     which color we get; side=left -> the color for the area below,
     etc.
+
+    color() deals with one value, colors_for() with a whole array
+    or dataframe column at once
      """
 
     @staticmethod
@@ -36,6 +41,24 @@ class CustomColors:
         self.colors = colors
         self.side = side
         assert len(ticks) == len(colors)-1
+        # for indices() and colors_for()
+        self._tick_values = np.array([tick for tick, _ in self.ticks],
+                                     dtype=float)
+        self._color_array = np.array(colors, dtype=object)
+        # a value equal to several ticks gets the color
+        # of the first one on the left side, if any
+        # so for each tick, the first left tick among the
+        # next ones with the same value, or the end of that group
+        nb_ticks = len(self.ticks)
+        self._first_left = np.arange(nb_ticks)
+        following = nb_ticks
+        for index in reversed(range(nb_ticks)):
+            tick, side = self.ticks[index]
+            if index + 1 < nb_ticks and self.ticks[index + 1][0] != tick:
+                following = index + 1
+            if side == 'left':
+                following = index
+            self._first_left[index] = following
 
     def color(self, value):
         for ((tick, side), color) in zip (self.ticks, self.colors):
@@ -44,6 +67,27 @@ class CustomColors:
                 return color
         return self.colors[-1]
 
+    def indices(self, values):
+        """
+        same as color() but on an array of values,
+        returns the indices in self.colors
+        """
+        values = np.asarray(values, dtype=float)
+        # the ticks strictly below, and the ones equal to each value
+        below = np.searchsorted(self._tick_values, values, side='left')
+        upto = np.searchsorted(self._tick_values, values, side='right')
+        equal = below < upto
+        result = below.copy()
+        result[equal] = self._first_left[below[equal]]
+        return result
+
+    def colors_for(self, values):
+        """
+        same as color() but on an array of values, or a dataframe column;
+        returns an array of colors
+        """
+        return self._color_array[self.indices(values)]
+
 
 def test():
 
@@ -81,6 +125,22 @@ def test():
         expected = colors[e]
         print(f"{i} -> {result} == {expected} - {result == expected}")
 
+    # colors_for() must match color() on all values, ties included
+    tied_ticks = [0., (1., 'right'), (1., 'left'), (1., 'right'), 2.]
+    tied_colors = ['c0', 'c1', 'c2', 'c3', 'c4', 'c5']
+    for ticks, colors, side in (
+            (ticks, inferno(8), 'left'), (ticks, inferno(8), 'right'),
+            (advanced_ticks, colors, 'right'),
+            (tied_ticks, tied_colors, 'left'),
+            (tied_ticks, tied_colors, 'right')):
+        scale = CustomColors(ticks, colors, side=side)
+        inputs = np.array([-2, 0., 0.4, 0.5, 0.7, 1., 1.1, 2., 3, 20,
+                           90, 100, 101, np.nan])
+        results = scale.colors_for(inputs)
+        expected = [scale.color(i) for i in inputs]
+        print(f"colors_for() on {len(inputs)} values with side={side} - "
+              f"{results.tolist() == expected}")
+
 
 if __name__ == '__main__':
     test()
@@ -19,6 +19,7 @@ from IPython.display import display
 
 # import a dictionary channel -> frequency
 from datastore import naming_scheme, receiver_nodes, sender_nodes
+from manifest import load_manifest
 from channels import channel_options
 from constants import CHOICES_INTERFERENCE
 
@@ -33,13 +34,21 @@ def available_interference_options(datadir):
     Compute which interferences are available in a given result dir
     Returns a dict suitable for a dropdown options attribute
     """
+    manifest = load_manifest(datadir)
+    if manifest is not None:
+        # only the runs with the current settings, like below
+        def exists(run_root):
+            return run_root.name in manifest['runs']
+    else:
+        def exists(run_root):
+            return run_root.exists()
     return {
         str(interference): interference
         for interference in INTERFERENCE_OPTIONS.keys()
         if any(
-            naming_scheme(run_name=datadir, protocol=protocol,
-                          interference=interference,
-                          autocreate=False).exists()
+            exists(naming_scheme(run_name=datadir, protocol=protocol,
+                                 interference=interference,
+                                 autocreate=False))
             for protocol in ('batman', 'olsr'))
     }
 
@@ -4,11 +4,16 @@
 
 import sys
 import re
+import time
+import warnings
 from pathlib import Path
 from datetime import datetime
 
 from collections import defaultdict, namedtuple
 
+import numpy as np
+import pandas as pd
+
 # should go away eventually
 import glob
 
@@ -18,6 +23,9 @@ from r2lab import R2labMap
 
 ####################
 
+from parsecache import file_cached, tree_cached, file_signature
+from manifest import load_manifest, run_pattern
+
 from constants import (
     WIRELESS_DRIVER, TX_POWER, PHY_RATE, CHANNEL, ANTENNA_MASK)
 
@@ -48,6 +56,7 @@ interference_line = (
 )
 
 # parse trace file
+@tree_cached('scrambler')
 def retrieve_scrambler_id(run_name, protocol, interference):
     root = naming_scheme(run_name=run_name, protocol=protocol,
                          interference=interference)
@@ -62,25 +71,41 @@ def retrieve_scrambler_id(run_name, protocol, interference):
                     return int(scrambler_id) if interference != "None" else None
 
 
-def sender_nodes(run_name):
-    """
-    Scans directory run_name and returns all nodes that have been
-    the destination of at least one ping
-    """
+@tree_cached('senders')
+def _scan_sender_nodes(run_name):
     all_pings = Path(run_name).glob("*/PING-??-??")
 
     return sorted({ping.name[-5:-3] for ping in all_pings})
 
 
-def receiver_nodes(run_name):
-    """
-    Scans directory run_name and returns all nodes that have been
-    the destination of at least one ping
-    """
+@tree_cached('receivers')
+def _scan_receiver_nodes(run_name):
     all_pings = Path(run_name).glob("*/PING-??-??")
 
     return sorted({ping.name[-2:] for ping in all_pings})
 
+
+def sender_nodes(run_name):
+    """
+    Returns all nodes that have been the source of at least one ping,
+    as per the manifest of run_name if present, by scanning it otherwise
+    """
+    manifest = load_manifest(run_name)
+    if manifest is not None:
+        return [f"{node:02d}" for node in manifest['sources']]
+    return _scan_sender_nodes(run_name)
+
+
+def receiver_nodes(run_name):
+    """
+    Returns all nodes that have been the destination of at least one ping,
+    as per the manifest of run_name if present, by scanning it otherwise
+    """
+    manifest = load_manifest(run_name)
+    if manifest is not None:
+        return [f"{node:02d}" for node in manifest['destinations']]
+    return _scan_receiver_nodes(run_name)
+
 ####################
 ### helpers
 def apssh_time():
@@ -99,78 +124,417 @@ def time_line(line, file=sys.stdout):
 
 
 ####################
-Packet = namedtuple( 'Packet', ['icmp_seq', 'rtt'] )
-
 PingDetails = namedtuple(
     'PingDetails',
     ['PDR', 'RTT'])
 
 
+# how many packets have we tried to send ?
+# this is in the header line written out by my-ping
+header_line = re.compile(
+    r'^ping .* -c (?P<nb_packets>[0-9]+) .*$',
+    re.MULTILINE)
+
+# parse each packet line
+# no need to anchor on the line start, which makes findall much faster
+packet_line = re.compile(
+    r': '
+    r'icmp_seq=(?P<icmp_seq>[0-9]+) '
+    r'ttl=(?P<ttl>[0-9]+) '
+    r'time=(?P<rtt>[0-9.]+) ms')
+
+
+def _scan_ping_contents(filename, warning):
+    """
+    returns nb_packets and the list of (icmp_seq, ttl, rtt) strings
+    """
+    try:
+        with open(filename) as ping_file:
+            contents = ping_file.read()
+    except IOError:
+        if warning:
+            path = Path(filename)
+            print("{} was not generated in these conditions: {}"
+                  .format(path.name, path.parent))
+        contents = ""
+
+    nb_packets = None
+    for match in header_line.finditer(contents):
+        nb_packets = int(match.group('nb_packets'))
+    return nb_packets, packet_line.findall(contents)
+
+
+def scan_ping_file(filename, warning=True):
+    """
+    Parse a PING file in one go and return a tuple
+    nb_packets, icmp_seqs, rtts
+    where the last 2 are numpy arrays, one item per received packet
+
+    nb_packets is None if the file could not be read
+    or has no header line
+    """
+    nb_packets, packets = _scan_ping_contents(filename, warning)
+    if packets:
+        seqs, _, rtts = zip(*packets)
+        icmp_seqs = np.array(seqs, dtype=np.int32)
+        rtts = np.array(rtts, dtype=np.float64)
+    else:
+        icmp_seqs = np.empty(0, dtype=np.int32)
+        rtts = np.empty(0, dtype=np.float64)
+    return nb_packets, icmp_seqs, rtts
+
+
+# returned if something goes wrong
+OOPS = PingDetails(PDR=1., RTT=10**10)
+
+
+@file_cached('ping')
+def _ping_counts(filename):
+    """
+    nb_packets, the number of received packets and their mean RTT
+    in a PING file; nb_packets is None if there is no header line
+
+    this is what gets cached, the warnings are issued
+    by read_ping_details() on each call
+    """
+    nb_packets, _, rtts = scan_ping_file(filename, warning=False)
+    return nb_packets, len(rtts), float(rtts.mean()) if len(rtts) else None
+
+
 def read_ping_details(filename, warning=True):
     """
     Return a PingDetails resulting from parsing a PING file
     """
+    nb_packets, received, rtt = _ping_counts(filename)
 
-    # how many packets have we tried to send ?
-    # this is in the header line written out by my-ping
-    header_line = (
-        r'ping .* -c (?P<nb_packets>[0-9]+) .*'
-    )
+    if not nb_packets:
+        if file_signature(filename) is None:
+            if warning:
+                path = Path(filename)
+                print("{} was not generated in these conditions: {}"
+                      .format(path.name, path.parent))
+        else:
+            print(f"OOPS, {filename} has no header line,"
+                  f" can't figure nb_packets")
+        return OOPS
 
-    # parse each packet line
-    packet_line = (
-        r'.*: '
-        r'icmp_seq=(?P<icmp_seq>[0-9]+) '
-        r'ttl=(?P<ttl>[0-9]+) '
-        r'time=(?P<rtt>[0-9.]+) ms'
-    )
+    if not received:
+        # this actually happens in very bad network conditions,
+        # and is not so unfrequent
+        # print(f"OOPS, {filename} has no packet line")
+        return OOPS
 
-    nb_packets = None
-    packets = []
+    pdr = 1 - received / nb_packets
+    return PingDetails(RTT=rtt, PDR=pdr)
+
+
+# the columns returned by read_all_ping_details
+PING_COLUMNS = ['PDR', 'RTT', 'received', 'jitter',
+                'min', 'max', 'p50', 'p90', 'p99']
+
+def ping_summary(nb_packets, rtts):
+    """
+    Computes all the columns in PING_COLUMNS for one pair;
+    the jitter is the mean absolute difference between
+    the RTTs of successive received packets
+    """
+    if not nb_packets or not len(rtts):
+        return dict(PDR=OOPS.PDR, RTT=OOPS.RTT, received=0,
+                    jitter=np.nan, min=np.nan, max=np.nan,
+                    p50=np.nan, p90=np.nan, p99=np.nan)
+    p50, p90, p99 = np.percentile(rtts, [50, 90, 99])
+    return dict(
+        PDR=1 - len(rtts) / nb_packets,
+        RTT=rtts.mean(),
+        received=len(rtts),
+        jitter=np.abs(np.diff(rtts)).mean() if len(rtts) > 1 else 0.,
+        min=rtts.min(), max=rtts.max(),
+        p50=p50, p90=p90, p99=p99)
+
+
+def read_all_ping_details(directory):
+    """
+    Parse all the PING files in a run directory in a single pass
 
-    # returned if something goes wrong
-    oops = PingDetails(PDR=1., RTT=10**10)
+    Returns a pandas DataFrame indexed on (source, destination)
+    with the columns in PING_COLUMNS
 
+    the statistics are computed on all pairs at once, using
+    offsets into the concatenation of all per-packet RTTs
+    """
+    index, nb_packets, received, all_rtts = [], [], [], []
+    for path in ping_files(directory):
+        nb, packets = _scan_ping_contents(path, warning=False)
+        index.append((int(path.name[-5:-3]), int(path.name[-2:])))
+        nb_packets.append(nb or 0)
+        received.append(len(packets))
+        all_rtts.extend(rtt for _, _, rtt in packets)
+    received = np.array(received, dtype=np.int64)
+    nb_packets = np.array(nb_packets, dtype=np.int64)
+    # convert all the RTTs at once
+    rtts = np.array(all_rtts, dtype=np.float64)
+    starts = np.concatenate(([0], np.cumsum(received)[:-1])).astype(np.int64)
+
+    columns = {column: np.full(len(index), np.nan) for column in PING_COLUMNS}
+    columns['received'] = received
+    columns['PDR'] = np.full(len(index), OOPS.PDR)
+    columns['RTT'] = np.full(len(index), float(OOPS.RTT))
+    # reduceat needs strictly increasing offsets, so we compute
+    # on the non-empty groups, and keep only the ones with a header
+    nonempty = received > 0
+    ok = (nb_packets > 0)[nonempty]
+    if ok.any():
+        where = np.flatnonzero(nonempty)[ok]
+        offsets, counts = starts[nonempty], received[nonempty]
+        columns['PDR'][where] = 1 - received[where] / nb_packets[where]
+        columns['RTT'][where] = (np.add.reduceat(rtts, offsets)[ok]
+                                 / counts[ok])
+        columns['min'][where] = np.minimum.reduceat(rtts, offsets)[ok]
+        columns['max'][where] = np.maximum.reduceat(rtts, offsets)[ok]
+        # jitter: ignore the differences that cross a group boundary
+        diffs = np.abs(np.diff(rtts, prepend=rtts[0]))
+        diffs[offsets] = 0.
+        columns['jitter'][where] = (np.add.reduceat(diffs, offsets)[ok]
+                                    / np.maximum(counts[ok] - 1, 1))
+        # percentiles, with linear interpolation like np.percentile
+        group = np.repeat(np.arange(len(index)), received)
+        ordered = rtts[np.lexsort((rtts, group))]
+        for column, quantile in (('p50', .5), ('p90', .9), ('p99', .99)):
+            position = quantile * (counts[ok] - 1)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            fraction = position - low
+            base = offsets[ok]
+            columns[column][where] = (
+                ordered[base + low] * (1 - fraction)
+                + ordered[base + high] * fraction)
+
+    return pd.DataFrame(
+        columns, columns=PING_COLUMNS,
+        index=pd.MultiIndex.from_tuples(
+            index, names=['source', 'destination']))
+
+
+def _original_ping_details(filename):
+    """
+    the pair-by-pair parser that read_all_ping_details replaces,
+    line by line with one re.match per pattern; only kept as
+    a reference for benchmark_ping_parsers
+    """
+    header = r'ping .* -c (?P<nb_packets>[0-9]+) .*'
+    packet = (r'.*: '
+              r'icmp_seq=(?P<icmp_seq>[0-9]+) '
+              r'ttl=(?P<ttl>[0-9]+) '
+              r'time=(?P<rtt>[0-9.]+) ms')
+    nb_packets, rtts = None, []
     try:
         with open(filename) as ping_file:
             for line in ping_file:
-                match = re.match(header_line, line)
+                match = re.match(header, line)
                 if match:
                     nb_packets = int(match.group('nb_packets'))
                     continue
-
-                match = re.match(packet_line, line)
+                match = re.match(packet, line)
                 if match:
-                    packets.append(Packet(
-                        icmp_seq=int(match.group('icmp_seq')),
-                        rtt=float(match.group('rtt')),
-                    ))
-                    continue
-
+                    rtts.append(float(match.group('rtt')))
     except IOError:
-        if warning:
-            path = Path(filename)
-            print("{} was not generated in these conditions: {}"
-                  .format(path.name, path.parent))
+        pass
+    if not nb_packets or not rtts:
+        return OOPS
+    return PingDetails(RTT=sum(rtts) / len(rtts),
+                       PDR=1 - len(rtts) / nb_packets)
 
-    if not nb_packets:
-        print("OOPS, {filename} has no header line, can't figure nb_packets")
-        return oops
 
-    if not packets:
-        # this actually happens in very bad network conditions,
-        # and is not so unfrequent
-        # print(f"OOPS, {filename} has no packet line")
-        return oops
+def benchmark_ping_parsers(*run_names, repeat=5):
+    """
+    compare, on all the runs in the run_name directories,
+    the original pair-by-pair parser and read_all_ping_details
 
-    pdr = 1 - len(packets) / nb_packets
-    rtt = sum(packet.rtt for packet in packets) / len(packets)
-    return PingDetails(RTT=rtt, PDR=pdr)
+    neither goes through the parse cache, so that
+    this times the actual parsing
+
+    prints and returns a dict run_name -> (per_pair, bulk)
+    best timings in seconds
+    """
+    def best_of(function):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    results = {}
+    for run_name in run_names:
+        run_roots = [run_root for run_root in sorted(Path(run_name).iterdir())
+                     if run_root.is_dir()]
+        files = [path for run_root in run_roots
+                 for path in ping_files(run_root)]
+        per_pair = best_of(lambda: [_original_ping_details(path)
+                                    for path in files])
+        bulk = best_of(lambda: [read_all_ping_details(run_root)
+                                for run_root in run_roots])
+        print(f"{run_name}: {len(files)} PING files - "
+              f"per pair {per_pair*1000:.1f} ms, bulk {bulk*1000:.1f} ms")
+        results[run_name] = (per_pair, bulk)
+    return results
+
+
+####################
+# columnar run store
+#
+# parsing one PING-ss-dd file per sender at each dashboard refresh
+# is expensive, so a run directory can be ingested once into
+# a single .npz file that holds all pairs; the per-packet details
+# are stored flat, with offsets[i]:offsets[i+1] being the range
+# for the i-th pair
+
+PING_STORE = "PINGS.npz"
+
+# node ids are 1..37, so 38 makes for simple indexing
+NB_IDS = 38
+
+
+def ping_files(run_root):
+    """
+    all PING-ss-dd files in a run directory, sorted
+    """
+    return sorted(Path(run_root).glob("PING-??-??"))
+
+
+def ingest_run(run_root, pool=None):
+    """
+    Parse all PING files in run_root - one naming_scheme() directory -
+    and store the results in a single PINGS.npz file in that directory
+
+    If provided, pool is a concurrent.futures executor
+    used to parse the PING files
+
+    Returns the path of the store
+    """
+    run_root = Path(run_root)
+    sources, destinations, pdrs, rtts = [], [], [], []
+    offsets = [0]
+    all_seqs, all_rtts = [], []
+    paths = ping_files(run_root)
+    scans = (pool.map(scan_ping_file, paths, chunksize=16) if pool
+             else map(scan_ping_file, paths))
+    for path, (nb_packets, icmp_seqs, packet_rtts) in zip(paths, scans):
+        sources.append(int(path.name[-5:-3]))
+        destinations.append(int(path.name[-2:]))
+        summary = ping_summary(nb_packets, packet_rtts)
+        pdrs.append(summary['PDR'])
+        rtts.append(summary['RTT'])
+        all_seqs.append(icmp_seqs)
+        all_rtts.append(packet_rtts)
+        offsets.append(offsets[-1] + len(icmp_seqs))
+
+    store = run_root / PING_STORE
+    np.savez(
+        store,
+        sources=np.array(sources, dtype=np.int16),
+        destinations=np.array(destinations, dtype=np.int16),
+        pdr=np.array(pdrs, dtype=np.float64),
+        rtt=np.array(rtts, dtype=np.float64),
+        offsets=np.array(offsets, dtype=np.int64),
+        icmp_seq=np.concatenate(all_seqs or [[]]).astype(np.int32),
+        rtts=np.concatenate(all_rtts or [[]]).astype(np.float32),
+    )
+    return store
+
+
+def ingest_runs(run_name):
+    """
+    Ingest all the run directories found under run_name
+    that contain at least one PING file
+    """
+    stores = []
+    for run_root in sorted(Path(run_name).iterdir()):
+        if run_root.is_dir() and ping_files(run_root):
+            time_line(f"ingesting {run_root}")
+            stores.append(ingest_run(run_root))
+    return stores
+
+
+class PingStore:
+    """
+    The in-memory view of a PINGS.npz file
+
+    index is a NB_IDS x NB_IDS array that gives, for a
+    (source, destination) couple, the row in the other arrays,
+    or -1 if that pair was not measured
+    """
+    def __init__(self, path):
+        with np.load(path) as npz:
+            for key in npz.files:
+                setattr(self, key, npz[key])
+        self.index = np.full((NB_IDS, NB_IDS), -1, dtype=np.int32)
+        self.index[self.sources, self.destinations] = \
+            np.arange(len(self.sources))
+
+    def details(self, source_id, destination_id):
+        """
+        a PingDetails instance, or None if this pair is not in the store
+        """
+        row = self.index[source_id, destination_id]
+        if row < 0:
+            return None
+        return PingDetails(PDR=float(self.pdr[row]), RTT=float(self.rtt[row]))
+
+    def packets(self, source_id, destination_id):
+        """
+        a tuple of arrays icmp_seq, rtts for that pair
+        """
+        row = self.index[source_id, destination_id]
+        if row < 0:
+            return None
+        begin, end = self.offsets[row], self.offsets[row+1]
+        return self.icmp_seq[begin:end], self.rtts[begin:end]
+
+
+# keep loaded stores around, hashed on path
+# and invalidated if the file changes
+_ping_stores = {}
+
+def load_ping_store(run_root):
+    """
+    Returns a PingStore for that run directory, or None
+    if the directory has not been ingested, or if the store
+    is older than the directory contents
+    """
+    run_root = Path(run_root)
+    store = run_root / PING_STORE
+    try:
+        mtime = store.stat().st_mtime
+        if mtime < run_root.stat().st_mtime:
+            return None
+    except OSError:
+        return None
+    cached = _ping_stores.get(store)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, PingStore(store))
+        _ping_stores[store] = cached
+    return cached[1]
+
+
+def ping_details(directory, source_id, destination_id):
+    """
+    Return a PingDetails for that pair in that run directory;
+    use the columnar store if available, and the PING file otherwise
+    """
+    store = load_ping_store(directory)
+    if store is not None:
+        details = store.details(source_id, destination_id)
+        if details is not None:
+            return details
+    return read_ping_details(
+        Path(directory) / f"PING-{source_id:02d}-{destination_id:02d}")
 
 
 ####################
 from customcolors import CustomColors
 from bokeh.palettes import Viridis
+from bokeh.models import ColumnDataSource
 
 PDR_COLORS = CustomColors(
     ticks=((-1, 'left'), (0., 'left'), 0.5, (1., 'right')),
@@ -183,32 +547,278 @@ RTT_COLORS = CustomColors(
     # we need one more color than ticks
     colors=['red'] + list(reversed(Viridis[8])))
 
+def details_arrays(directory, source_ids, destination_ids):
+    """
+    PDR and RTT for all (source, destination) pairs at once,
+    as 2 arrays [len(source_ids), len(destination_ids)]
+
+    pairs where source and destination are the same node get
+    PDR=-1 and RTT=0; values come from the columnar store if
+    available, the PING files are only read for missing pairs
+    """
+    sources = np.array(source_ids, dtype=int).reshape(-1)
+    destinations = np.array(destination_ids, dtype=int).reshape(-1)
+    shape = (len(sources), len(destinations))
+    pdr = np.full(shape, OOPS.PDR)
+    rtt = np.full(shape, float(OOPS.RTT))
+    rows = np.full(shape, -1)
+    store = load_ping_store(directory)
+    if store is not None:
+        rows = store.index[np.ix_(sources, destinations)]
+        found = rows >= 0
+        pdr[found] = store.pdr[rows[found]]
+        rtt[found] = store.rtt[rows[found]]
+    same = sources[:, None] == destinations[None, :]
+    for i, j in zip(*np.nonzero((rows < 0) & ~same)):
+        details = read_ping_details(
+            Path(directory) / f"PING-{sources[i]:02d}-{destinations[j]:02d}")
+        pdr[i, j], rtt[i, j] = details.PDR, details.RTT
+    pdr[same], rtt[same] = -1, 0.
+    return pdr, rtt
+
+
+def details_payload(dataframe, node_ids, pdr, rtt):
+    """
+    store the PDR and RTT arrays for node_ids in the input dataframe,
+    together with their colors, and return the data for a
+    ColumnDataSource, i.e. ColumnDataSource.from_df(dataframe)
+    """
+    # I could not get bokeh's colormapper system to
+    # work exactly for me, so let's apply a home-made mapper
+    # and store the result in separate columns
+    dataframe.loc[list(node_ids), ['PDR', 'RTT', 'PDRC', 'RTTC']] = \
+        pd.DataFrame(dict(PDR=pdr, RTT=rtt,
+                          PDRC=PDR_COLORS.colors_for(pdr),
+                          RTTC=RTT_COLORS.colors_for(rtt)),
+                     index=list(node_ids))
+    return ColumnDataSource.from_df(dataframe)
+
+
 def details_from_all_senders(dataframe, run_name,
                              protocol, interference,
                              destination_id, sources):
     """
     fill input dataframe with RTT and PDR
     for all sender nodes to this receiver node
+
+    returns the data for the ColumnDataSource, see details_payload()
     """
 
     directory = naming_scheme(run_name=run_name, protocol=protocol,
                               interference=interference)
+    pdr, rtt = details_arrays(directory, sources, [destination_id])
+    return details_payload(dataframe, sources, pdr[:, 0], rtt[:, 0])
 
-    for source_id in sources:
-        if source_id == destination_id:
-            ping_details = PingDetails(PDR=-1, RTT=0.)
-        else:
-            ping_filename = (
-                directory / f"PING-{source_id:02d}-{destination_id:02d}")
-            ping_details = read_ping_details(ping_filename)
-        dataframe.loc[source_id]['PDR'] = ping_details.PDR
-        dataframe.loc[source_id]['RTT'] = ping_details.RTT
-        # I could not get bokeh's colormapper system to
-        # work exactly for me, so let's apply a home-made mapper
-        # and store the result in separate columns
-        dataframe.loc[source_id]['PDRC'] = PDR_COLORS.color(ping_details.PDR)
-        dataframe.loc[source_id]['RTTC'] = RTT_COLORS.color(ping_details.RTT)
 
+def details_from_all_receivers(dataframe, run_name,
+                               protocol, interference,
+                               source_id, destinations):
+    """
+    fill input dataframe with RTT and PDR
+    from this sender node to all receiver nodes
+
+    returns the data for the ColumnDataSource, see details_payload()
+    """
+
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    pdr, rtt = details_arrays(directory, [source_id], destinations)
+    return details_payload(dataframe, destinations, pdr[0], rtt[0])
+
+
+def payloads_for_all_receivers(dataframe, run_name,
+                               protocol, interference,
+                               sources, receivers):
+    """
+    same as details_from_all_senders, for all receivers at once
+
+    returns a dictionary receiver -> data for the ColumnDataSource,
+    so that switching receivers boils down to one data push
+    """
+
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    pdr, rtt = details_arrays(directory, sources, receivers)
+    return {
+        receiver: details_payload(dataframe.copy(), sources,
+                                  pdr[:, index], rtt[:, index])
+        for index, receiver in enumerate(receivers)
+    }
+
+
+####################
+# full source x destination matrices
+#
+# all the PDRs and RTTs of a run as 2 arrays [NB_IDS, NB_IDS]
+# indexed by source and destination ids, with NaN for the pairs
+# that were not measured, and an RTT of NaN when nothing got through
+
+PROTOCOLS = ('batman', 'olsr')
+
+# run directory -> (signature, pdr, rtt)
+_ping_matrices = {}
+
+def ping_matrices(run_name, protocol, interference):
+    """
+    returns pdr, rtt as 2 read-only arrays [NB_IDS, NB_IDS]
+
+    they come from the PINGS.npz store if the run directory has been
+    ingested, otherwise the PING files are parsed in memory - this
+    never writes in the run directory; the matrices are kept
+    as long as the store, or the directory, does not change
+    """
+    directory = naming_scheme(run_name=run_name, protocol=protocol,
+                              interference=interference)
+    store = load_ping_store(directory)
+    if store is not None:
+        signature = ('store', file_signature(directory / PING_STORE))
+    else:
+        signature = ('files', file_signature(directory))
+    cached = _ping_matrices.get(directory)
+    if cached and cached[0] == signature:
+        return cached[1:]
+    pdr = np.full((NB_IDS, NB_IDS), np.nan)
+    rtt = np.full((NB_IDS, NB_IDS), np.nan)
+    if store is not None:
+        sources, destinations = store.sources, store.destinations
+        pdrs, rtts = store.pdr, store.rtt
+    elif ping_files(directory):
+        details = read_all_ping_details(directory)
+        sources = details.index.get_level_values('source')
+        destinations = details.index.get_level_values('destination')
+        pdrs, rtts = details.PDR.to_numpy(), details.RTT.to_numpy()
+    else:
+        sources = destinations = pdrs = rtts = []
+    pdr[sources, destinations] = pdrs
+    rtt[sources, destinations] = np.where(
+        np.asarray(rtts) < OOPS.RTT, rtts, np.nan)
+    # the same arrays are returned on each call
+    pdr.flags.writeable = False
+    rtt.flags.writeable = False
+    _ping_matrices[directory] = (signature, pdr, rtt)
+    return pdr, rtt
+
+
+def _metric(run_name, protocol, interference, metric):
+    pdr, rtt = ping_matrices(run_name, protocol, interference)
+    return dict(PDR=pdr, RTT=rtt)[metric]
+
+
+def protocol_difference(run_name, interference, metric='PDR'):
+    """
+    batman minus olsr, for metric 'PDR' or 'RTT',
+    as an array [NB_IDS, NB_IDS]
+    """
+    batman, olsr = (_metric(run_name, protocol, interference, metric)
+                    for protocol in PROTOCOLS)
+    return batman - olsr
+
+
+def node_aggregates(run_name, protocol, interference):
+    """
+    a dataframe indexed by node id, with the mean PDR and RTT
+    of the pings sent (_out) and received (_in) by each node
+    """
+    pdr, rtt = ping_matrices(run_name, protocol, interference)
+    measured = ~np.isnan(pdr)
+    node_ids = np.flatnonzero(measured.any(axis=0) | measured.any(axis=1))
+    with warnings.catch_warnings():
+        # nodes that only send, or only receive
+        warnings.simplefilter('ignore', RuntimeWarning)
+        columns = dict(
+            PDR_out=np.nanmean(pdr, axis=1), PDR_in=np.nanmean(pdr, axis=0),
+            RTT_out=np.nanmean(rtt, axis=1), RTT_in=np.nanmean(rtt, axis=0),
+            sent=measured.sum(axis=1), received=measured.sum(axis=0))
+    return pd.DataFrame(
+        {column: values[node_ids] for column, values in columns.items()},
+        index=pd.Index(node_ids, name='node'))
+
+
+def interference_level(interference):
+    """
+    the numeric value of an interference, with None meaning 0
+    """
+    return 0. if interference in (None, "None") else float(interference)
+
+
+def interference_slopes(run_name, protocol, metric='PDR',
+                        interferences=None):
+    """
+    for each pair, the slope of the least squares fit of metric
+    against the interference level, as an array [NB_IDS, NB_IDS];
+    NaN for the pairs measured with less than 2 levels
+
+    interferences default to all the ones that have a run directory
+    for protocol with the current settings; 'None' is not a level,
+    and so it is never part of the fit
+    """
+    if interferences is None:
+        pattern = naming_scheme(run_name=run_name, protocol=protocol,
+                                interference="*")
+        interferences = [
+            run_pattern.match(run_root.name).group('interference')
+            for run_root in Path(run_name).glob(pattern.name)
+            if run_pattern.match(run_root.name)]
+    interferences = [interference for interference in interferences
+                     if interference not in (None, "None")]
+    if len(interferences) < 2:
+        warnings.warn(f"{run_name}: less than 2 interference levels"
+                      f" for {protocol}, slopes are undefined")
+        return np.full((NB_IDS, NB_IDS), np.nan)
+    levels = np.array([interference_level(interference)
+                       for interference in interferences])
+    values = np.stack([_metric(run_name, protocol, interference, metric)
+                       for interference in interferences])
+    # all pairs at once, ignoring the missing values
+    known = ~np.isnan(values)
+    count = known.sum(axis=0)
+    x = np.where(known, levels[:, None, None], 0.)
+    y = np.where(known, values, 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = x.sum(axis=0) / count
+        mean_y = y.sum(axis=0) / count
+        covariance = (known * (x - mean_x) * (y - mean_y)).sum(axis=0)
+        variance = (known * (x - mean_x) ** 2).sum(axis=0)
+        slopes = covariance / variance
+    slopes[(count < 2) | (variance == 0)] = np.nan
+    return slopes
+
+
+def matrix_heatmap(matrix, colors=PDR_COLORS, node_ids=None, title=None,
+                   size=500):
+    """
+    a bokeh figure that shows a [NB_IDS, NB_IDS] matrix, e.g. from
+    ping_matrices() or protocol_difference(), with sources as rows
+    and destinations as columns, in one glyph
+
+    colors is a CustomColors; node_ids default to the
+    nodes with a value
+    """
+    # pylint: disable=import-outside-toplevel
+    from bokeh.plotting import figure
+    if node_ids is None:
+        known = ~np.isnan(matrix)
+        node_ids = np.flatnonzero(known.any(axis=0) | known.any(axis=1))
+    node_ids = np.asarray(node_ids)
+    block = matrix[np.ix_(node_ids, node_ids)]
+    names = [f"{node_id:02d}" for node_id in node_ids.tolist()]
+    source = ColumnDataSource(dict(
+        source=[name for name in names for _ in names],
+        destination=names * len(names),
+        value=block.ravel(),
+        color=np.where(np.isnan(block.ravel()), 'white',
+                       colors.colors_for(block.ravel())),
+    ))
+    fig = figure(title=title, x_range=names, y_range=list(reversed(names)),
+                 frame_width=size, frame_height=size,
+                 x_axis_label='destination', y_axis_label='source',
+                 tools="hover,save,reset",
+                 tooltips=[('source', '@source'),
+                           ('destination', '@destination'),
+                           ('value', '@value')])
+    fig.rect(x='destination', y='source', width=1, height=1,
+             fill_color='color', line_color=None, source=source)
+    return fig
 
 
 #######
@@ -218,6 +828,7 @@ def is_valid_route(route):
     return True
 
 
+@file_cached('routes')
 def get_all_routes(filename):
     routes = []
     try:
@@ -309,3 +920,14 @@ def routing_graph(run_name, interference,
         dot = get_edges_from_routes(dot, routes)
 
         return dot
+
+
+if __name__ == '__main__':
+    # e.g. python3 datastore.py datasample13
+    # to ingest all PING files of a set of runs
+    # or python3 datastore.py --benchmark datasample datasample13
+    if sys.argv[1:2] == ['--benchmark']:
+        benchmark_ping_parsers(*sys.argv[2:])
+    else:
+        for arg in sys.argv[1:]:
+            ingest_runs(arg)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# pylint: disable=c0111
+
+"""
+A MANIFEST.json file at the root of a run_name directory
+describes all the runs in there, so that dashboards can figure out
+the available protocols, interferences, sources and destinations
+without scanning the whole tree
+
+It is maintained by runs.one_run each time a run completes;
+for older directories, rebuild it with
+
+    python3 manifest.py run_name [run_name ...]
+
+and python3 manifest.py test for a self-check
+"""
+
+import sys
+import re
+import json
+from pathlib import Path
+
+MANIFEST = "MANIFEST.json"
+
+# see datastore.naming_scheme
+run_pattern = re.compile(
+    r'^t(?P<tx_power>[^-]+)-r(?P<phy_rate>[^-]+)-a(?P<antenna_mask>[^-]+)'
+    r'-ch(?P<channel>[^-]+)-I(?P<interference>.+)-(?P<protocol>[^-]+)$')
+
+# artifact kind -> glob pattern in a run directory
+artifact_patterns = {
+    'PING': "PING-??-??",
+    'PINGS.npz': "PINGS.npz",
+    'ROUTE-TABLE': "ROUTE-TABLE-??",
+    'ROUTE-TABLE-SAMPLED': "ROUTE-TABLE-??-SAMPLED",
+    'ROUTES': "ROUTES-??",
+    'SAMPLES': "SAMPLES/ROUTES-??-SAMPLE",
+    'ROUTE-EVENTS': "SAMPLES/ROUTE-EVENTS.npz",
+    'IPERF': "IPERF-??-??",
+    'pcap': "fit*.pcap",
+    'result': "result-*.txt",
+    'RSSI': "RSSI.txt",
+    'trace': "trace-*",
+}
+
+
+def describe_run(run_root):
+    """
+    a dictionary that describes one naming_scheme() directory,
+    or None if its name does not follow the naming scheme
+    """
+    run_root = Path(run_root)
+    match = run_pattern.match(run_root.name)
+    if not match:
+        return None
+    pings = [path.name for path in run_root.glob("PING-??-??")]
+    return dict(
+        protocol=match.group('protocol'),
+        interference=match.group('interference'),
+        sources=sorted({int(ping[-5:-3]) for ping in pings}),
+        destinations=sorted({int(ping[-2:]) for ping in pings}),
+        artifacts=sorted(kind for kind, pattern in artifact_patterns.items()
+                         if any(run_root.glob(pattern))),
+    )
+
+
+def _summarize(runs):
+    """
+    compute the global fields from the per-run ones
+    """
+    def union(field):
+        return sorted({x for run in runs.values() for x in run[field]})
+    return dict(
+        runs=runs,
+        protocols=sorted({run['protocol'] for run in runs.values()}),
+        interferences=sorted({run['interference'] for run in runs.values()}),
+        sources=union('sources'),
+        destinations=union('destinations'),
+    )
+
+
+def _write(run_name, runs):
+    path = Path(run_name) / MANIFEST
+    # write in a temporary file first, so that readers never
+    # see a partially written manifest
+    tmp = path.with_suffix(".tmp")
+    with tmp.open('w') as feed:
+        json.dump(_summarize(runs), feed, indent=2)
+    tmp.replace(path)
+    return path
+
+
+def update_manifest(run_name, run_root):
+    """
+    (re)describe one run directory in the manifest of run_name
+
+    if run_name has no manifest yet, e.g. an older archive,
+    it is first rebuilt from all the run directories in there
+    """
+    manifest = load_manifest(run_name)
+    if manifest is None:
+        rebuild_manifest(run_name)
+        manifest = load_manifest(run_name)
+    runs = dict(manifest['runs'])
+    description = describe_run(run_root)
+    if description is not None:
+        runs[Path(run_root).name] = description
+    return _write(run_name, runs)
+
+
+def rebuild_manifest(run_name):
+    """
+    scan all run directories in run_name and write a fresh manifest
+    """
+    runs = {}
+    for run_root in sorted(Path(run_name).iterdir()):
+        if run_root.is_dir():
+            description = describe_run(run_root)
+            if description is not None:
+                runs[run_root.name] = description
+    return _write(run_name, runs)
+
+
+# path -> (mtime, contents)
+_manifests = {}
+
+def load_manifest(run_name):
+    """
+    the contents of the manifest in run_name, or None if there is none
+    """
+    path = Path(run_name) / MANIFEST
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _manifests.get(path)
+    if cached is None or cached[0] != mtime:
+        with path.open() as feed:
+            cached = (mtime, json.load(feed))
+        _manifests[path] = cached
+    return cached[1]
+
+
+def test():
+    """
+    update_manifest() on an archive with several runs and no manifest
+    """
+    import shutil
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        run_name = Path(tmp) / "datasample"
+        shutil.copytree(Path(__file__).parent / "datasample", run_name)
+        (run_name / MANIFEST).unlink(missing_ok=True)
+        expected = sorted(path.name for path in run_name.iterdir()
+                          if run_pattern.match(path.name))
+        update_manifest(run_name, run_name / expected[0])
+        runs = sorted(load_manifest(run_name)['runs'])
+        print(f"{len(runs)} runs kept out of {len(expected)} -"
+              f" {runs == expected}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        for arg in sys.argv[1:]:
+            print(f"wrote {rebuild_manifest(arg)}")
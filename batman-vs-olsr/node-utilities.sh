@@ -258,6 +258,48 @@ function route-sample-olsr(){
     done
     return 0
 }
+# wait for the routing protocol to converge, i.e. until the routing
+# table has a route to at least <expected> destinations, and has
+# remained the same over <stable> consecutive samples
+# taken every <period> seconds; give up after <timeout> seconds
+# this always returns 0, as the timeout is just an upper bound
+function wait-for-routes (){
+    local protocol=$1; shift
+    local expected=$1; shift
+    local stable=$1; shift
+    local period=$1; shift
+    local timeout=$1; shift
+
+    local start=$(date +%s)
+    local previous=""
+    local samples=0
+    while true; do
+        local current=$(route-$protocol | sort)
+        local destinations=$(echo "$current" | awk 'NF {print $1}' | sort -u | wc -l)
+        local elapsed=$(( $(date +%s) - $start ))
+        if [ "$destinations" -ge "$expected" ]; then
+            if [ "$current" == "$previous" ]; then
+                samples=$(($samples+1))
+            else
+                samples=1
+            fi
+        else
+            samples=0
+        fi
+        previous="$current"
+        if [ "$samples" -ge "$stable" ]; then
+            echo "$protocol converged after $elapsed s - $destinations routes"
+            return 0
+        fi
+        if [ "$elapsed" -ge "$timeout" ]; then
+            echo "$protocol not converged after $elapsed s" \
+                 "- $destinations/$expected routes, $samples stable samples"
+            return 0
+        fi
+        sleep $period
+    done
+}
+
 function kill-batman (){
 
     echo "Kill batman daemon"
@@ -0,0 +1,229 @@
+# pylint: disable=c0111
+
+"""
+A persistent memoization layer for the datastore readers
+
+The notebook callbacks end up reading and globbing the same files
+over and over again; so results get cached, first in memory, and then
+in a sqlite sidecar file at the root of each run_name directory,
+so that they survive a kernel restart
+
+Each entry is tagged with a signature - mtime and size of the file,
+or mtimes of the run directories - and gets recomputed as soon as that
+signature changes, e.g. while runs.py is still acquiring data
+
+Hit/miss counters are kept in memory, see stats()
+"""
+
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict, Counter
+from functools import wraps
+from pathlib import Path
+import time
+
+SIDECAR = ".parse-cache.sqlite"
+
+# how many entries we keep in the sqlite file, and in memory
+DISK_ENTRIES = 20000
+MEMORY_ENTRIES = 2000
+
+# kind -> Counter with keys 'memory', 'disk' and 'miss'
+_stats = {}
+
+
+def stats():
+    """
+    returns a dictionary kind -> dict(memory=, disk=, miss=)
+    where memory and disk are hit counters
+    """
+    return {kind: dict(counter) for kind, counter in _stats.items()}
+
+
+def reset_stats():
+    _stats.clear()
+
+
+def _count(kind, what):
+    _stats.setdefault(kind, Counter())[what] += 1
+
+
+def file_signature(path):
+    """
+    mtime and size of a file, None if it does not exist
+    """
+    try:
+        stat = Path(path).stat()
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def tree_signature(run_name):
+    """
+    the names and mtimes of all the subdirectories of run_name;
+    this changes whenever a file is created or removed
+    in one of the run directories
+
+    we can't use the mtime of run_name itself, as it is
+    where the sidecar file gets written
+    """
+    root = Path(run_name)
+    try:
+        return tuple((sub.name, sub.stat().st_mtime_ns)
+                     for sub in sorted(root.iterdir())
+                     if sub.is_dir())
+    except OSError:
+        return None
+
+
+class ParseCache:
+    """
+    one instance per run_name directory
+
+    the sqlite file is optional; if it cannot be created - e.g. on
+    a read-only dataset - we just go on with the in-memory cache;
+    likewise a failing read on the sqlite file counts as a miss
+
+    it can be used from several threads, e.g. from the notebook
+    callbacks; the sqlite connection is shared, behind a lock
+    """
+
+    def __init__(self, root, *,
+                 disk_entries=DISK_ENTRIES, memory_entries=MEMORY_ENTRIES):
+        self.root = Path(root)
+        self.disk_entries = disk_entries
+        self.memory_entries = memory_entries
+        # (kind, key) -> (signature, value), most recently used last
+        self.memory = OrderedDict()
+        # disk hits are recorded here, and written
+        # together with the next new entry
+        self.touched = {}
+        # protects the 3 above, and the sqlite connection
+        self.lock = threading.Lock()
+        try:
+            self.db = sqlite3.connect(str(self.root / SIDECAR),
+                                      check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " kind TEXT, key TEXT, signature TEXT, value BLOB, used REAL,"
+                " PRIMARY KEY (kind, key))")
+            self.db.commit()
+        except sqlite3.Error:
+            self.db = None
+
+    def _remember(self, kind, key, signature, value):
+        self.memory[kind, key] = (signature, value)
+        self.memory.move_to_end((kind, key))
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _disk_get(self, kind, key, signature):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(
+                "SELECT value FROM cache"
+                " WHERE kind=? AND key=? AND signature=?",
+                (kind, key, signature)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is not None:
+            self.touched[kind, key] = time.time()
+        return row
+
+    def _disk_set(self, kind, key, signature, value):
+        if self.db is None:
+            return
+        try:
+            self.db.executemany(
+                "UPDATE cache SET used=? WHERE kind=? AND key=?",
+                [(used, kind, key)
+                 for (kind, key), used in self.touched.items()])
+            self.touched.clear()
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (kind, key, signature, pickle.dumps(value), time.time()))
+            # LRU eviction
+            self.db.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache ORDER BY used DESC"
+                " LIMIT -1 OFFSET ?)", (self.disk_entries,))
+            self.db.commit()
+        except (sqlite3.Error, pickle.PicklingError):
+            pass
+
+    def get(self, kind, key, signature, compute):
+        """
+        returns the cached value for (kind, key) if its signature
+        matches, otherwise calls compute() and caches its result
+        """
+        signature = repr(signature)
+        with self.lock:
+            cached = self.memory.get((kind, key))
+            if cached is not None and cached[0] == signature:
+                self.memory.move_to_end((kind, key))
+                _count(kind, 'memory')
+                return cached[1]
+            row = self._disk_get(kind, key, signature)
+            if row is not None:
+                value = pickle.loads(row[0])
+                _count(kind, 'disk')
+                self._remember(kind, key, signature, value)
+                return value
+        # compute outside of the lock, so that other threads
+        # are not held back by a slow reader
+        value = compute()
+        with self.lock:
+            _count(kind, 'miss')
+            self._disk_set(kind, key, signature, value)
+            self._remember(kind, key, signature, value)
+        return value
+
+
+# root -> ParseCache
+_caches = {}
+
+
+def cache_for(root):
+    root = Path(root).resolve()
+    if root not in _caches:
+        _caches[root] = ParseCache(root)
+    return _caches[root]
+
+
+def _key(args, kwds):
+    return repr((args, sorted(kwds.items())))
+
+
+def file_cached(kind):
+    """
+    decorator for readers whose first argument is a file in a run
+    directory - like PING-ss-dd - and whose result only depends
+    on that file's contents
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapped(filename, *args, **kwds):
+            path = Path(filename)
+            return cache_for(path.parent.parent).get(
+                kind, _key((str(path),) + args, kwds), file_signature(path),
+                lambda: function(filename, *args, **kwds))
+        return wrapped
+    return decorator
+
+
+def tree_cached(kind):
+    """
+    decorator for readers whose first argument is a run_name,
+    and that scan the run directories under that root
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapped(run_name, *args, **kwds):
+            return cache_for(run_name).get(
+                kind, _key(args, kwds), tree_signature(run_name),
+                lambda: function(run_name, *args, **kwds))
+        return wrapped
+    return decorator
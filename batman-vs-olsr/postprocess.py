@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# pylint: disable=c0111, w0703
+
+"""
+Post-processing of the data gathered by runs.one_run, i.e.
+
+* the ROUTES-xx files from the ROUTE-TABLE-xx snapshots (map)
+* the SAMPLES/ files from the ROUTE-TABLE-xx-SAMPLED ones (route sampling)
+* the result-xx.txt files from the fitxx.pcap ones (tshark),
+  see pcaprssi.py, and then RSSI.txt
+* the PINGS.npz store
+
+The independent pieces of work are fanned out
+over a pool of processes, one per local core
+
+During a sweep, a Pipeline runs all this in the background,
+while the next run is acquiring its data
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from processroute import ProcessRoutes
+from processmap import Aggregator
+from pcaprssi import write_result
+from datastore import time_line, ingest_run
+from manifest import update_manifest, run_pattern
+
+
+def process_pool(max_workers=None):
+    """
+    a pool of processes for the post-processing work
+
+    workers get created lazily, i.e. from whatever thread happens to
+    submit, while ssh connections and other threads are running;
+    so they are started from a clean forkserver process, rather than
+    forked from the current one
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('forkserver'))
+
+
+def build_routes(run_root, src_ids, node_ids):
+    ProcessRoutes(run_root, src_ids, node_ids).run()
+
+
+def build_sampled_routes(run_root, src_ids, node_ids):
+    ProcessRoutes(run_root, src_ids, node_ids).run_sampled()
+
+
+def parse_pcap(run_root, node_id):
+    """
+    extract the RSSIs of the pings received by node_id
+    from fitxx.pcap into result-xx.txt
+    """
+    write_result(run_root / f"fit{node_id}.pcap",
+                 run_root / f"result-{node_id}.txt", node_id)
+
+
+def aggregate_rssi(run_root, node_ids, antenna_mask):
+    Aggregator(run_root, node_ids, antenna_mask).run()
+
+
+def _check(futures, labels):
+    """
+    wait for futures and report the failed ones;
+    returns True if all went fine
+    """
+    ok = True
+    for future in futures:
+        try:
+            future.result()
+        except Exception as exc:
+            time_line(f"post-processing {labels[future]} failed: {exc}")
+            ok = False
+    return ok
+
+
+def post_process(run_root, *, node_ids, src_ids, antenna_mask,
+                 map=False, route_sampling=False, tshark=False,
+                 pool=None, max_workers=None):
+    """
+    run all the post-processing on one naming_scheme() directory
+
+    the features are the ones of one_run; the work is submitted
+    to pool if provided, otherwise to a new process_pool()
+    with max_workers processes - defaults to the number of local cores
+
+    returns True if all went fine
+    """
+    # pylint: disable=w0622
+    if pool is None:
+        with process_pool(max_workers) as pool:
+            return post_process(
+                run_root, node_ids=node_ids, src_ids=src_ids,
+                antenna_mask=antenna_mask, map=map,
+                route_sampling=route_sampling, tshark=tshark, pool=pool)
+
+    run_root = Path(run_root)
+    labels = {}
+    def submit(label, function, *args):
+        future = pool.submit(function, run_root, *args)
+        labels[future] = label
+        return future
+
+    others = []
+    if map:
+        others.append(submit("map", build_routes, src_ids, node_ids))
+    if route_sampling:
+        others.append(submit("route sampling", build_sampled_routes,
+                             src_ids, node_ids))
+    pcaps = []
+    if tshark:
+        pcaps = [submit(f"pcap from {node_id}", parse_pcap, node_id)
+                 for node_id in node_ids]
+    # RSSI.txt needs all the result-xx.txt files
+    ok = _check(pcaps, labels)
+    if tshark and ok:
+        others.append(submit("RSSI", aggregate_rssi,
+                             node_ids, int(antenna_mask)))
+    ok = _check(others, labels) and ok
+    # do this last, as the store is deemed outdated
+    # if the directory changes afterwards
+    time_line(f"Creation of PING store in {run_root}")
+    ingest_run(run_root, pool=pool)
+    return ok
+
+
+def _clock(timestamp):
+    return time.strftime("%H-%M-%S", time.localtime(timestamp))
+
+
+class Pipeline:
+    """
+    post-processing in the background during a sweep, so that the
+    acquisition of the next run can start right away
+
+    like in reprocess(), each run directory gets one thread,
+    that fans out the work over a shared pool of processes
+
+    typical use
+
+        with Pipeline() as pipeline:
+            for ...:
+                # acquire data in run_root
+                pipeline.submit(run_name, run_root, ok, durations, ...)
+        # all post-processing is done here
+    """
+
+    def __init__(self, max_workers=None):
+        max_workers = max_workers or os.cpu_count()
+        self.processes = process_pool(max_workers)
+        self.threads = ThreadPoolExecutor(max_workers=max_workers)
+        # the manifest is shared among all runs in a run_name
+        self.manifest_lock = threading.Lock()
+        # (run_root, submission time, future)
+        self.runs = []
+
+    def submit(self, run_name, run_root, ok, durations,
+               on_done=None, **kwds):
+        """
+        if ok, post-process run_root with post_process(**kwds), and
+        set durations['post-processing']; in any case, update the
+        manifest of run_name, and then call on_done(ok) if provided;
+        returns right away
+        """
+        future = self.threads.submit(
+            self._finish, run_name, Path(run_root), ok, durations,
+            on_done, kwds)
+        self.runs.append((run_root, time.time(), future))
+
+    def _finish(self, run_name, run_root, ok, durations, on_done, kwds):
+        beginning = time.time()
+        if ok:
+            time_line(f"Post-processing {run_root}")
+            ok = post_process(run_root, pool=self.processes, **kwds)
+            durations['post-processing'] = time.time() - beginning
+        with self.manifest_lock:
+            update_manifest(run_name, run_root)
+        if on_done is not None:
+            on_done(ok)
+        return ok, time.time()
+
+    def join(self):
+        """
+        wait for all the runs submitted so far, and
+        tell when each one was done
+
+        returns True if all went fine
+        """
+        overall = True
+        for run_root, submitted, future in self.runs:
+            try:
+                ok, done = future.result()
+            except Exception as exc:
+                time_line(f"post-processing {run_root} failed: {exc}")
+                ok, done = False, time.time()
+            overall = overall and ok
+            print(f"{run_root}: {'OK' if ok else 'KO'} -"
+                  f" acquired at {_clock(submitted)},"
+                  f" post-processed at {_clock(done)}"
+                  f" (+{done - submitted:.0f}s)")
+        self.runs = []
+        return overall
+
+    def close(self):
+        self.join()
+        self.threads.shutdown()
+        self.processes.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def discover(run_root):
+    """
+    figure out the settings of an existing run directory
+    from its contents, as keyword arguments for post_process()
+    """
+    run_root = Path(run_root)
+    def names(pattern):
+        return [path.name for path in run_root.glob(pattern)]
+    pings = names("PING-??-??")
+    sampled = {int(name[12:14]) for name in names("ROUTE-TABLE-??-SAMPLED")}
+    snapshots = {int(name[12:14]) for name in names("ROUTE-TABLE-??")}
+    pcaps = {int(name[3:-5]) for name in names("fit*.pcap")}
+    # route processing needs one file per node, so when
+    # routes are available, they tell the nodes in the mesh
+    node_ids = sorted(
+        sampled | snapshots
+        or pcaps | {int(ping[-5:-3]) for ping in pings}
+        | {int(ping[-2:]) for ping in pings})
+    src_ids = sorted({int(ping[-5:-3]) for ping in pings}) or node_ids
+    match = run_pattern.match(run_root.name)
+    return dict(
+        node_ids=node_ids, src_ids=src_ids,
+        antenna_mask=match.group('antenna_mask') if match else 1,
+        map=bool(snapshots), route_sampling=bool(sampled),
+        tshark=bool(pcaps),
+    )
+
+
+def reprocess(*run_roots, max_workers=None):
+    """
+    redo the post-processing of existing run directories
+
+    all directories are handled at the same time, so that
+    the pool of processes remains busy
+    """
+    def one_dir(run_root):
+        run_root = Path(run_root)
+        settings = discover(run_root)
+        time_line(f"reprocessing {run_root} with {settings}")
+        return post_process(run_root, pool=pool, **settings)
+
+    max_workers = max_workers or os.cpu_count()
+    with process_pool(max_workers) as pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as threads:
+        oks = list(threads.map(one_dir, run_roots))
+    # the manifest is shared among all runs in a run_name
+    for run_root in run_roots:
+        update_manifest(Path(run_root).parent, run_root)
+    return all(oks)
@@ -5,29 +5,175 @@
     Will be called at the end of one_run to generate
     a file containing the paths from the
     different nodes selected to do the pings from
+
+    The routing state is held in numpy arrays of next hops,
+    indexed by [sample, source, destination]; paths are then
+    computed for all destinations and all samples at once
+
+    Sampled tables are read in lockstep and processed by chunks,
+    only the changes from one sample to the next are kept
 """
 
+import heapq
+from collections import deque
+from contextlib import ExitStack
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
 from datastore import time_line
 
+# node ids are 1..37, so 38 makes for simple indexing
+NB_IDS = 38
+# next hop when there is no route
+NO_ROUTE = 0
+# written in a route in place of the hops, once a loop is detected
+LOOP = -1
+# padding in the hops arrays
+PAD = -2
+# how many samples get walked and written at a time
+CHUNK_SAMPLES = 256
+# the route changes, in the SAMPLES subdir, see routeevents.py
+ROUTE_EVENTS = "ROUTE-EVENTS.npz"
+
+
+def parse_route_line(line):
+    """
+    returns a tuple dest_id, hop_id from one line of
+    either route -n (olsr) or ip route (batman)
+
+    raises ValueError if the line can't be parsed
+    """
+    #Batman has another way to display routes
+    #since we cannot use route -n
+    line = line.replace("via", "")
+    dest_ip, hop_ip, *_ = line.split()
+    if hop_ip == "dev":
+        hop_ip = dest_ip
+    dest_id = int(dest_ip.split(".")[-1])
+    hop_id = int(hop_ip.split(".")[-1])
+    if not (0 <= dest_id < NB_IDS and 0 <= hop_id < NB_IDS):
+        raise ValueError(f"unexpected node id in {line}")
+    return dest_id, hop_id
+
+
+def walk_routes(tables, source, destinations):
+    """
+    Computes the routes from source to all destinations,
+    in all samples at once
+
+    Parameters:
+      tables: an array of next hops [samples, NB_IDS, NB_IDS]
+      source: the node id where routes start from
+      destinations: a list of node ids
+
+    Returns:
+      a tuple hops, loops where
+      * hops is an int16 array [samples, destinations, steps]
+        with the intermediate hops, padded with PAD; a NO_ROUTE hop
+        means the route is broken at that point
+      * loops is a boolean array [samples, destinations]
+
+    A route is deemed to loop if it is still going after
+    len(destinations) + 1 hops, like the original implementation;
+    in that case hops is truncated right after the first hop
+    that is repeated
+    """
+    destinations = np.asarray(destinations, dtype=np.int16)
+    nb_samples = tables.shape[0]
+    max_steps = len(destinations) + 1
+    samples = np.arange(nb_samples)[:, None]
+    current = np.full((nb_samples, len(destinations)), source, dtype=np.int16)
+    active = np.ones(current.shape, dtype=bool)
+    hops = np.full(current.shape + (max_steps,), PAD, dtype=np.int16)
+    for step in range(max_steps):
+        next_hop = tables[samples, current, destinations]
+        active &= (current != NO_ROUTE) & (next_hop != destinations)
+        if not active.any():
+            break
+        hops[..., step] = np.where(active, next_hop, PAD)
+        current = np.where(active, next_hop, current)
+    loops = active
+
+    # truncate looping routes after the first repeated node,
+    # the source being considered as the first node
+    if loops.any():
+        looping = hops[loops]
+        path = np.concatenate(
+            (np.full((len(looping), 1), source, dtype=np.int16), looping),
+            axis=1)
+        # repeated[r, i] is True if path[r, i] was seen before i
+        repeated = np.tril(path[:, :, None] == path[:, None, :], k=-1).any(axis=2)
+        first = repeated.argmax(axis=1)
+        # path[i] is hops[i-1]
+        steps = np.arange(max_steps)
+        looping[steps[None, :] >= first[:, None]] = PAD
+        hops[loops] = looping
+    return hops, loops
+
+
+# the textual form of all node ids
+NAMES = [str(node_id) for node_id in range(NB_IDS)]
+
+
+def format_route(source, destination, hops, loop):
+    """
+    the textual form of one route, as found in the ROUTES files
+    e.g. 1 -- 14 -- 33 or 1 -- 19 -- 27 -- 19 -- -1 -- 37
+
+    hops is a list of node ids, possibly padded with PAD
+    """
+    nodes = [NAMES[source]]
+    nodes.extend(NAMES[hop] for hop in hops if hop != PAD)
+    if loop:
+        nodes.append(str(LOOP))
+    nodes.append(NAMES[destination])
+    return " -- ".join(nodes)
+
+
 class ProcessRoutes:
     def __init__(self, run_root, exp_nodes, node_ids):
         self.run_root = run_root
         self.exp_nodes = exp_nodes
         self.node_ids = node_ids
-        self.all_routes = {
-            (source, destination): 0
-            for source in node_ids
-            for destination in node_ids
-            if source != destination
-        }
+        self.reset()
 
     def reset(self):
-        self.all_routes = {
-            (source, destination): 0
-            for source in self.node_ids
-            for destination in self.node_ids
-            if source != destination
-        }
+        self.all_routes = np.zeros((NB_IDS, NB_IDS), dtype=np.int16)
+
+    def write_routes(self, result_file, tables, exp_node, samples=None):
+        """
+        write the routes from exp_node for all the tables
+
+        if provided, samples is a list of sample numbers,
+        one for each table, that are written as headers
+        """
+        destinations = [dest for dest in self.node_ids if dest != exp_node]
+        if not destinations:
+            return
+        hops, loops = walk_routes(tables, exp_node, destinations)
+        # routes rarely change from one sample to the next,
+        # so each distinct set of routes gets formatted only once
+        flat = np.concatenate(
+            (hops.reshape(len(hops), -1), loops.astype(np.int16)), axis=1)
+        # route text, indexed by the bytes of hops and loops
+        texts = {}
+        for index, row in enumerate(flat):
+            key = row.tobytes()
+            text = texts.get(key)
+            if text is None:
+                # much faster to iterate on python lists than on numpy arrays
+                text = "".join(
+                    format_route(exp_node, dest, route_hops, loop) + "\n"
+                    for dest, route_hops, loop
+                    in zip(destinations, hops[index].tolist(),
+                           loops[index].tolist()))
+                texts[key] = text
+            if samples is not None:
+                result_file.write(f"SAMPLE {samples[index]}\n")
+            result_file.write(text)
+
     def run(self):
         #Generating Src,Dest : next_hop  table
         time_line("Generation global routing map")
@@ -36,156 +182,173 @@ class ProcessRoutes:
             time_line(f"creating {file_name}")
             with file_name.open() as file_routes:
                 for line in file_routes:
-                    #Batman has another way to display routes
-                    #since we cannot use route -n
-                    line = line.replace("via", "")
-                    dest_ip, hop_ip, *_ = line.split()
-                    if hop_ip == "dev":
-                        hop_ip = dest_ip
-                    dest_id = int(dest_ip.split(".")[-1])
-                    hop_id = int(hop_ip.split(".")[-1])
+                    try:
+                        dest_id, hop_id = parse_route_line(line)
+                    except ValueError:
+                        continue
                     self.all_routes[source_id, dest_id] = hop_id
 
         #generate route map file for each selected nodes:
         time_line("Creating files with routes summary - one per exp node")
         for exp_node in self.exp_nodes:
             result_name = self.run_root / f"ROUTES-{exp_node:02d}"
-            line_start = "{} --".format(exp_node)
             time_line(f"creating {result_name}")
             with result_name.open("w") as result_file:
-                for dest in self.node_ids:
-                    line_to_write = line_start
-                    src = exp_node
-                    if dest != exp_node:
-                        loop_detector = 0
-                        while src != 0 and self.all_routes[src, dest] != dest:
-                            next_hop = self.all_routes[src, dest]
-                            line_to_write += " {} --".format(next_hop)
-                            src = next_hop
-                            loop_detector = loop_detector + 1
-                            if loop_detector > len(self.node_ids):
-                                #time_line(result_name)
-                                #time_line("SAMPLE {}".format(sample))
-                                #time_line(" dest : {}".format( dest))
-                                #time_line("LOOP")
-                                hops = line_to_write.split("--")
-                                hops.remove('')
-                                read_hops = []
-
-                                for hop in hops:
-                                    if int(hop) not in read_hops:
-                                        read_hops.append(int(hop))
-                                    else:
-                                        read_hops.append(int(hop))
-                                        #log_line(read_hops)
-                                        line_to_write = "{} --".format(exp_node)
-                                        read_hops.remove(read_hops[0])
-                                        for i in read_hops:
-                                            line_to_write += " {} --".format(i)
-                                        line_to_write += " {} --".format("-1")
-                                        #log_line(line_to_write)
-                                        break
-                                break
-                        line_to_write += " {}".format(dest)
-                        result_file.write(line_to_write+ "\n")
+                self.write_routes(result_file, self.all_routes[None, ...],
+                                  exp_node)
+
+    def read_sampled_file(self, source_id, parsed):
+        """
+        a generator over the samples in ROUTE-TABLE-xx-SAMPLED
+        that yields tuples (sample, source_id, routes)
+        where routes is a tuple of 2 lists, destinations and hops
+
+        parsed is a dictionary line -> (dest_id, hop_id) shared
+        among all nodes, as the same lines show up in most samples
+        """
+        file_name = self.run_root / f"ROUTE-TABLE-{source_id:02d}-SAMPLED"
+        time_line(f"Creating {file_name}")
+        sample, dests, hops = None, None, None
+        goto_next_sample = False
+        with file_name.open() as file_routes:
+            for line in file_routes:
+                if "SAMPLE" in line:
+                    if sample is not None:
+                        yield sample, source_id, (dests, hops)
+                    # lines look like 'SAMPLE : 12 '
+                    try:
+                        sample = int(line.split(":")[-1])
+                    except ValueError:
+                        sample = 0 if sample is None else sample + 1
+                    dests, hops = [], []
+                    goto_next_sample = False
+                elif sample is not None and not goto_next_sample:
+                    if line not in parsed:
+                        try:
+                            parsed[line] = parse_route_line(line)
+                        except ValueError:
+                            parsed[line] = None
+                    route = parsed[line]
+                    if route is None:
+                        goto_next_sample = True
+                    else:
+                        dests.append(route[0])
+                        hops.append(route[1])
+        if sample is not None:
+            yield sample, source_id, (dests, hops)
 
+    def iter_sampled(self):
+        """
+        reads all the ROUTE-TABLE-xx-SAMPLED files in lockstep,
+        and yields tuples (sample, table) where table is a
+        [NB_IDS, NB_IDS] array of next hops
+
+        each sample is a full snapshot, a node that has no
+        such sample contributes no route
+
+        only one sample is held in memory at any time - well, unless
+        the last node happens to be missing some samples
+        """
+        parsed = {}
+        readers = [self.read_sampled_file(source_id, parsed)
+                   for source_id in self.node_ids]
+        # the last sample of the last node is most likely truncated
+        # as sampling gets stopped, so like before we ignore it;
+        # that is to say, a sample gets released only once
+        # the last node has moved past it
+        last_node = self.node_ids[-1] if self.node_ids else None
+        pending = deque()
+        merged = heapq.merge(*readers, key=itemgetter(0))
+        for sample, group in groupby(merged, key=itemgetter(0)):
+            table = np.zeros((NB_IDS, NB_IDS), dtype=np.int16)
+            confirms = False
+            for _, source_id, (dests, hops) in group:
+                table[source_id, dests] = hops
+                confirms = confirms or source_id == last_node
+            if confirms:
+                while pending:
+                    yield pending.popleft()
+            pending.append((sample, table))
 
     def run_sampled(self):
+        """
+        writes SAMPLES/ROUTES-xx-SAMPLE for all exp nodes,
+        and keeps the route changes in self.route_changes,
+        see changes_as_arrays(); these are also saved
+        in SAMPLES/ROUTE-EVENTS.npz
+
+        memory usage does not depend on the run duration,
+        except for the route changes themselves
+        """
         #Generating Src,Dest : next_hop  table
         time_line("Generation global sampled routing map")
         newdir = self.run_root / "SAMPLES"
         newdir.mkdir(parents=True, exist_ok=True)
-        sample_num = -1
-        goto_next_sample = False
-        dict_maps = {0 : self.all_routes.copy()}
-        for source_id in self.node_ids:
-            file_name = self.run_root / f"ROUTE-TABLE-{source_id:02d}-SAMPLED"
-            sample_num = -1
-            time_line(f"Creating {file_name}")
-            with file_name.open() as file_routes:
-                for line in file_routes:
-                    #time_line(line)
-                    #time_line(file_name)
-                    if "SAMPLE" in line:
-                        if sample_num >= 0:
-                            dict_maps[sample_num] = self.all_routes.copy()
-                        sample_num = sample_num +1
-                        goto_next_sample = False
-                        try:
-                            self.all_routes = dict_maps[sample_num].copy()
-                        except KeyError:
-                            self.reset()
-                            dict_maps[sample_num] = self.all_routes.copy()
-                    else:
-                        #Batman has another way to display routes
-                        #since we cannot use route -n
-                        if not goto_next_sample:
-                            try:
-                                line = line.replace("via", "")
-                                #log_line(sample_num)
-                                #log_line(line)
-                                dest_ip, hop_ip, *_ = line.split()
-                                if hop_ip == "dev":
-                                    hop_ip = dest_ip
-                                dest_id = int(dest_ip.split(".")[-1])
-                                hop_id = int(hop_ip.split(".")[-1])
-                                self.all_routes[source_id, dest_id] = hop_id
-                            except ValueError:
-                                goto_next_sample = True
-                dict_maps[sample_num] = self.all_routes.copy()
-                #log_line(self.all_routes)
-
-        #get sample num and write routing parsed to file sample num -1
 
+        self.route_changes = []
+        # first and last sample numbers
+        self.sample_range = None
+        previous = np.zeros((NB_IDS, NB_IDS), dtype=np.int16)
+        samples, tables = [], []
+        with ExitStack() as stack:
+            result_files = {}
+            for exp_node in self.exp_nodes:
+                result_name = newdir / f"ROUTES-{exp_node:02d}-SAMPLE"
+                time_line(f"Creating {result_name}")
+                result_files[exp_node] = stack.enter_context(
+                    result_name.open("w"))
 
-        for exp_node in self.exp_nodes:
-            result_name = (self.run_root / "SAMPLES"
-                           / f"ROUTES-{exp_node:02d}-SAMPLE")
-            line_start = "{} --".format(exp_node)
-            time_line(f"Creating {result_name}")
-            with result_name.open("w") as result_file:
-                for sample in range(0, sample_num):
-                    result_file.write("SAMPLE {}".format(sample) + "\n")
-                    for dest in self.node_ids:
-                        line_to_write = line_start
-                        src = exp_node
-                        if dest != exp_node:
-                            loop_detector = 0
-                            while src != 0 and dict_maps[sample][src, dest] != dest:
-                                next_hop = dict_maps[sample][src, dest]
-                                #log_line("------------------------------------")
-                                #log_line("Source : {}".format(exp_node))
-                                #time_line"Sample : {}".format(sample))
-                                #time_lineresult_name)
-                                #log_line("src : {} dest : {}".format(src, dest))
-                                #time_line"next hop: {}".format(next_hop))
-                                #time_line"------------------------------------")
-                                line_to_write += " {} --".format(next_hop)
-                                src = next_hop
-                                loop_detector = loop_detector + 1
-                                if loop_detector > len(self.node_ids):
-                                    #log_line(result_name)
-                                    #log_line("SAMPLE {}".format(sample))
-                                    #log_line(" dest : {}".format( dest))
-                                    #log_line("LOOP")
-                                    hops = line_to_write.split("--")
-                                    hops.remove('')
-                                    read_hops = []
-
-                                    for hop in hops:
-                                        if int(hop) not in read_hops:
-                                            read_hops.append(int(hop))
-                                        else:
-                                            read_hops.append(int(hop))
-                                            #log_line(read_hops)
-                                            line_to_write = "{} --".format(exp_node)
-                                            read_hops.remove(read_hops[0])
-                                            for i in read_hops:
-                                                line_to_write += " {} --".format(i)
-                                            line_to_write += " {} --".format("-1")
-                                            #log_line(line_to_write)
-                                            break
-                                    break
-
-                            line_to_write += " {}".format(dest)
-                            result_file.write(line_to_write+ "\n")
+            def flush():
+                if samples:
+                    for exp_node, result_file in result_files.items():
+                        self.write_routes(result_file, np.stack(tables),
+                                          exp_node, samples=samples)
+                samples.clear()
+                tables.clear()
+
+            for sample, table in self.iter_sampled():
+                sources, dests = np.nonzero(table != previous)
+                if len(sources):
+                    self.route_changes.append(
+                        (sample, sources, dests,
+                         previous[sources, dests], table[sources, dests]))
+                previous = table
+                self.sample_range = (
+                    sample if self.sample_range is None
+                    else self.sample_range[0], sample)
+                samples.append(sample)
+                tables.append(table)
+                if len(samples) >= CHUNK_SAMPLES:
+                    flush()
+            flush()
+        self.save_changes(newdir / ROUTE_EVENTS)
+
+    def save_changes(self, path):
+        """
+        store the route changes in a .npz file, together
+        with the range of samples, and the nodes involved
+        """
+        time_line(f"Creating {path}")
+        np.savez(path,
+                 sample_range=np.array(self.sample_range or (0, -1),
+                                       dtype=np.int32),
+                 node_ids=np.array(self.node_ids, dtype=np.int16),
+                 **self.changes_as_arrays())
+
+    def changes_as_arrays(self):
+        """
+        the route changes found by run_sampled(), as a dictionary
+        of same-length arrays sample, source, destination, old_hop, new_hop
+
+        the first sample shows up as changes from NO_ROUTE
+        """
+        columns = dict(sample=[], source=[], destination=[],
+                       old_hop=[], new_hop=[])
+        for sample, *arrays in self.route_changes:
+            columns['sample'].append(np.full(len(arrays[0]), sample))
+            for name, array in zip(list(columns)[1:], arrays):
+                columns[name].append(array)
+        return {name: np.concatenate(arrays).astype(
+                    np.int32 if name == 'sample' else np.int16)
+                if arrays else np.zeros(0, dtype=np.int16)
+                for name, arrays in columns.items()}
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# pylint: disable=c0111, c0103, r0914
+
+"""
+Route changes, as extracted from the sampled routing tables
+by processroute.ProcessRoutes.run_sampled(), and metrics thereof
+
+An event is a row (sample, source, destination, old_hop, new_hop)
+in SAMPLES/ROUTE-EVENTS.npz; the first sample shows up as changes
+from NO_ROUTE; samples are taken every SAMPLING_PERIOD seconds
+by route-sample-service.sh
+
+To compare batman and olsr on all the runs in a run_name, do
+
+    python3 routeevents.py run_name [run_name ...]
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from processroute import (
+    ProcessRoutes, walk_routes, NB_IDS, ROUTE_EVENTS)
+from manifest import load_manifest, run_pattern
+
+# as per route-sample-service.sh
+SAMPLING_PERIOD = 0.5
+# how many samples without a change before
+# the routing is deemed converged
+STABLE_SAMPLES = 10
+
+
+def sampled_node_ids(run_root):
+    """
+    the ids of the nodes that have a ROUTE-TABLE-xx-SAMPLED file
+    """
+    return sorted(int(path.name[12:14])
+                  for path in Path(run_root).glob("ROUTE-TABLE-??-SAMPLED"))
+
+
+def load_route_events(run_root):
+    """
+    the contents of SAMPLES/ROUTE-EVENTS.npz as a dictionary of arrays;
+    the file gets computed from the sampled tables if needed
+
+    returns None if the run has no route sampling at all
+    """
+    run_root = Path(run_root)
+    path = run_root / "SAMPLES" / ROUTE_EVENTS
+    if not path.exists():
+        node_ids = sampled_node_ids(run_root)
+        if not node_ids:
+            return None
+        # no exp node, so only the events get written
+        ProcessRoutes(run_root, [], node_ids).run_sampled()
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def _bounds(events):
+    first, last = events['sample_range'].tolist()
+    return first, last
+
+
+def route_flaps(events):
+    """
+    a dataframe indexed by (source, destination) with the number
+    of times the route has changed, not counting the first sample
+    """
+    first, _ = _bounds(events)
+    node_ids = events['node_ids']
+    changes = events['sample'] > first
+    pairs = (events['source'][changes].astype(int) * NB_IDS
+             + events['destination'][changes])
+    flaps = np.bincount(pairs, minlength=NB_IDS * NB_IDS)
+    flaps = flaps.reshape(NB_IDS, NB_IDS)[np.ix_(node_ids, node_ids)]
+    index = pd.MultiIndex.from_product(
+        [node_ids, node_ids], names=['source', 'destination'])
+    dataframe = pd.DataFrame(dict(flaps=flaps.ravel()), index=index)
+    return dataframe[index.get_level_values(0) != index.get_level_values(1)]
+
+
+def route_lifetimes(events):
+    """
+    a dataframe with one row per route, i.e. per (source, destination,
+    next hop) that was in place for some time, with columns
+    source, destination, hop, start (a sample number),
+    lifetime (in seconds) and censored
+
+    censored is True for the routes still in place at the end
+    of the sampling, whose actual lifetime is unknown
+
+    a hop of NO_ROUTE accounts for a period with no route at all
+    """
+    _, last = _bounds(events)
+    order = np.lexsort((events['sample'], events['destination'],
+                        events['source']))
+    sources = events['source'][order]
+    destinations = events['destination'][order]
+    starts = events['sample'][order]
+    # the following event on the same pair, if any, ends a route
+    censored = np.ones(len(order), dtype=bool)
+    censored[:-1] = ((sources[1:] != sources[:-1])
+                     | (destinations[1:] != destinations[:-1]))
+    ends = np.full(len(order), last + 1, dtype=starts.dtype)
+    ends[:-1] = np.where(censored[:-1], last + 1, starts[1:])
+    return pd.DataFrame(dict(
+        source=sources, destination=destinations,
+        hop=events['new_hop'][order], start=starts,
+        lifetime=(ends - starts) * SAMPLING_PERIOD, censored=censored))
+
+
+def time_to_convergence(events, start_sample=None, stable=STABLE_SAMPLES):
+    """
+    the time in seconds between start_sample and the first moment
+    where the routes do not change for stable samples in a row;
+    NaN if that never happens
+
+    start_sample defaults to the first sample; note that runs.py
+    starts the scrambler and lets the network settle before sampling
+    starts, so the default measures from the beginning of the sampling
+    """
+    first, last = _bounds(events)
+    start = first if start_sample is None else start_sample
+    changes = np.unique(events['sample'][events['sample'] > start])
+    # candidate convergence points are the start and all changes
+    points = np.concatenate(([start], changes))
+    following = np.append(changes, last + 1)
+    quiet = np.nonzero(following - points > stable)[0]
+    if not len(quiet):
+        return np.nan
+    return (points[quiet[0]] - start) * SAMPLING_PERIOD
+
+
+def replay(events):
+    """
+    rebuilds the routing tables from the events
+
+    returns a tuple samples, tables where tables is an array
+    [states, NB_IDS, NB_IDS] of next hops, and the i-th table
+    is in place from samples[i] until the next one
+    """
+    samples, firsts = np.unique(events['sample'], return_index=True)
+    tables = np.zeros((len(samples), NB_IDS, NB_IDS), dtype=np.int16)
+    table = np.zeros((NB_IDS, NB_IDS), dtype=np.int16)
+    bounds = np.append(firsts, len(events['sample']))
+    for state, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        table[events['source'][begin:end],
+              events['destination'][begin:end]] = events['new_hop'][begin:end]
+        tables[state] = table
+    return samples, tables
+
+
+def loop_episodes(events):
+    """
+    a dataframe with one row per routing loop episode, i.e. a period
+    during which the route between a (source, destination) pair
+    loops, with columns source, destination, start, end
+    (sample numbers, end excluded) and duration in seconds
+    """
+    _, last = _bounds(events)
+    node_ids = events['node_ids'].tolist()
+    samples, tables = replay(events)
+    looping = np.zeros((len(samples), NB_IDS, NB_IDS), dtype=bool)
+    for source in node_ids:
+        destinations = [dest for dest in node_ids if dest != source]
+        _, loops = walk_routes(tables, source, destinations)
+        looping[:, source, destinations] = loops
+    # pad with no loop before the first and after the last state
+    looping = looping.reshape(len(samples), -1)
+    padded = np.zeros((len(samples) + 2, NB_IDS * NB_IDS), dtype=np.int8)
+    padded[1:-1] = looping
+    transitions = np.diff(padded, axis=0).T
+    # sorted by pair, and then by state, so starts and ends match
+    pairs, begin_states = np.nonzero(transitions == 1)
+    _, end_states = np.nonzero(transitions == -1)
+    bounds = np.append(samples, last + 1)
+    starts, ends = bounds[begin_states], bounds[end_states]
+    return pd.DataFrame(dict(
+        source=pairs // NB_IDS, destination=pairs % NB_IDS,
+        start=starts, end=ends, duration=(ends - starts) * SAMPLING_PERIOD))
+
+
+def route_summary(events, stable=STABLE_SAMPLES):
+    """
+    a dictionary of figures that characterize the routing
+    stability in one run
+    """
+    flaps = route_flaps(events)
+    lifetimes = route_lifetimes(events)
+    complete = lifetimes[~lifetimes.censored].lifetime
+    loops = loop_episodes(events)
+    first, last = _bounds(events)
+    return dict(
+        duration=(last - first + 1) * SAMPLING_PERIOD,
+        flaps=flaps.flaps.sum(),
+        flapping_pairs=(flaps.flaps > 0).sum(),
+        lifetime_mean=complete.mean(),
+        lifetime_median=complete.median(),
+        convergence=time_to_convergence(events, stable=stable),
+        loop_episodes=len(loops),
+        loop_time=loops.duration.sum(),
+    )
+
+
+def compare_protocols(run_name, stable=STABLE_SAMPLES):
+    """
+    a dataframe with one route_summary() per run in run_name,
+    indexed by the run settings, e.g. to compare protocols
+    with compare_protocols(run_name).unstack('protocol')
+
+    the runs with no sampled routes are left out, so the result
+    may be empty, but it is always indexed by the run settings
+    """
+    manifest = load_manifest(run_name)
+    if manifest is not None:
+        names = sorted(manifest['runs'])
+    else:
+        names = sorted(path.name for path in Path(run_name).iterdir()
+                       if path.is_dir())
+    rows, keys = [], []
+    for name in names:
+        match = run_pattern.match(name)
+        if not match:
+            continue
+        events = load_route_events(Path(run_name) / name)
+        if events is None:
+            continue
+        keys.append(tuple(match.groupdict().values()))
+        rows.append(route_summary(events, stable=stable))
+    # from_arrays rather than from_tuples, that cannot cope with no run;
+    # this way the index levels are there even when the frame is empty
+    index = pd.MultiIndex.from_arrays(
+        [list(level) for level in zip(*keys)] if keys
+        else [[] for _ in run_pattern.groupindex],
+        names=list(run_pattern.groupindex))
+    return pd.DataFrame(rows, index=index)
+
+
+if __name__ == '__main__':
+    with pd.option_context('display.width', 200,
+                           'display.max_columns', None):
+        for arg in sys.argv[1:]:
+            print(f"==================== {arg}")
+            summaries = compare_protocols(arg)
+            if summaries.empty:
+                print("no sampled routes")
+            else:
+                print(summaries.unstack('protocol'))
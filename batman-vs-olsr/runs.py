@@ -9,25 +9,28 @@ Script to run batman or OLSR routing protocol on R2lab
 # pylint: disable=c0103, r0912, r0913, r0914, r0915
 
 import itertools
+import time
+from pathlib import Path
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import shutil
 
-from asynciojobs import Scheduler, Sequence, PrintJob
+from asynciojobs import Scheduler, Sequence, PrintJob, Job
 
-from apssh import SshNode, SshJob, LocalNode
+from apssh import SshJob
 from apssh import Run, RunScript, Pull, Push
-from apssh import TimeHostFormatter
-from apssh import close_ssh_in_scheduler
+from apssh import Variables, Capture
 
 from r2lab import ListOfChoices
 
 # helpers
-#from processmap import Aggregator
-from processroute import ProcessRoutes
+from postprocess import post_process, reprocess, Pipeline
 from channels import channel_frequency
 
 from datastore import naming_scheme, apssh_time, time_line
+from manifest import update_manifest, artifact_patterns
+from nodepool import NodePool
+from journal import Journal
 
 from constants import (
     WIRELESS_DRIVER, TX_POWER, PHY_RATE, CHANNEL, ANTENNA_MASK,
@@ -47,6 +50,39 @@ default_protocol = ['batman']
 # once all the nodes have their wireless interface configured
 settle_delay_long = 40
 settle_delay_shorter = 10
+# how the settle phases end
+# fixed: sleep for the settle delays above
+# probe: poll the routing tables on all nodes, and proceed as soon as
+#   each node has a route to all the others, that has remained
+#   the same for settle_stable_samples consecutive samples;
+#   the settle delays above are then only an upper bound
+choices_settle = ['probe', 'fixed']
+default_settle = 'probe'
+settle_stable_samples = 3
+# in seconds
+settle_probe_period = 2
+# with the keep-mesh sweep, the upper bound for settling
+# again after the interference level has changed
+settle_delay_retune = 10
+
+# how all_runs goes through protocols x interferences
+# restart: each run sets up the wireless network and the
+#   routing protocol from scratch, and tears them down at the end
+# keep-mesh: the runs for one protocol share the same mesh,
+#   only uhd_siggen is retuned between interference levels
+choices_sweep = ['restart', 'keep-mesh']
+default_sweep = 'restart'
+
+# the files that make a run complete, see journal.py; the .npz
+# stores are left out, as they get rebuilt whenever outdated,
+# and so are the traces, that one_run keeps writing to
+journal_patterns = [pattern for kind, pattern in artifact_patterns.items()
+                    if kind != 'trace' and not pattern.endswith(".npz")]
+
+# the phases in one_run, for reporting their durations
+# extras is for warmup, iperf and the like, after settle
+phases = ['setup', 'settle', 'extras', 'pings',
+          'wrap-up', 'post-processing']
 # antenna mask for each node, three values are allowed: 1, 3, 7
 
 all_node_ids = [str(i) for i in range(1, 38)]
@@ -63,6 +99,20 @@ warmup_ping_size = 64
 warmup_ping_interval = 0.5
 warmup_ping_messages = 20
 
+# how the PING-ss-dd files get back here
+# pull: each ping job pulls its own file, i.e. one sftp session per pair
+# stream: the ping output is captured from the ssh channel,
+#   and written locally as soon as the ping is over
+# batch: one Pull per source once all pings are done
+choices_ping_fetch = ['pull', 'stream', 'batch']
+default_ping_fetch = 'pull'
+
+# how the ping jobs get scheduled
+# sequential: one ping at a time
+# rounds: see ping_rounds()
+choices_ping_schedule = ['sequential', 'rounds']
+default_ping_schedule = 'sequential'
+
 
 # convenience
 def fitname(node_id):
@@ -80,6 +130,112 @@ def purgedir(path):
     shutil.rmtree(path)
 
 
+def phases_summary(durations):
+    """
+    a one-liner from a dictionary phase -> duration in seconds
+    """
+    return ", ".join(f"{phase} {durations[phase]:.0f}s"
+                     for phase in phases if phase in durations)
+
+
+def stop_mesh(pool, protocol, node_index,
+              scrambler_id, node_scrambler, verbose_jobs):
+    """
+    stops the routing protocol on all nodes, and if node_scrambler
+    is not None, uhd_siggen and the usrp on the scrambler
+
+    this is for cleaning up after a failed run that was meant
+    to leave the mesh up; failures are ignored
+    """
+    scheduler = Scheduler(verbose=verbose_jobs, label="Stop mesh")
+    for id, node in node_index.items():
+        SshJob(
+            scheduler=scheduler,
+            node=node,
+            critical=False,
+            label=f"kill routing protocol on {id}",
+            verbose=verbose_jobs,
+            command=RunScript("node-utilities.sh",
+                              f"kill-{protocol}",
+                              label=f"kill-{protocol}"),
+        )
+    if node_scrambler is not None:
+        kill_uhd_siggen = SshJob(
+            scheduler=scheduler,
+            node=node_scrambler,
+            critical=False,
+            label=f"killing uhd_siggen on the scrambler node {scrambler_id}",
+            verbose=verbose_jobs,
+            command=Run("systemctl", "stop", "uhd_siggen"),
+        )
+        SshJob(
+            scheduler=scheduler,
+            node=pool.gateway,
+            critical=False,
+            required=kill_uhd_siggen,
+            label=f"turning off usrp on the scrambler node {scrambler_id}",
+            verbose=verbose_jobs,
+            command=Run("rhubarbe", "usrpoff", scrambler_id),
+        )
+    pool.run(scheduler)
+
+
+def ping_rounds(pairs):
+    """
+    split a list of (source, destination) pairs into rounds
+    where no node appears twice, so that the pings in a round
+    can run at the same time, while each node is involved
+    in only one flow at a time
+
+    this uses the circle method: each rotation of the nodes
+    gives a perfect matching of the complete graph, which gives
+    one round for the pairs in one direction and one for the
+    reverse direction; so a full mesh on n nodes takes
+    about 2n rounds, instead of n(n-1) sequential pings
+
+    returns a list of lists of pairs, in the original order
+    within each round
+    """
+    todo = set(pairs)
+    nodes = sorted({node for pair in pairs for node in pair})
+    # an odd number of nodes means one rests at each round
+    if len(nodes) % 2:
+        nodes.append(None)
+    nb_nodes = len(nodes)
+    fixed, rotating = nodes[:1], nodes[1:]
+    rounds = []
+    for _ in range(nb_nodes - 1):
+        circle = fixed + rotating
+        forward, reverse = set(), set()
+        for i in range(nb_nodes // 2):
+            a, b = circle[i], circle[nb_nodes - 1 - i]
+            if a is None or b is None:
+                continue
+            a, b = min(a, b), max(a, b)
+            directions = [pair for pair in ((a, b), (b, a)) if pair in todo]
+            forward.update(directions[:1])
+            reverse.update(directions[1:])
+        rounds.extend([pair for pair in pairs if pair in round]
+                      for round in (forward, reverse) if round)
+        rotating = rotating[-1:] + rotating[:-1]
+    return rounds
+
+
+class PingOutputs(Variables):
+    """
+    where the ping jobs capture their output in 'stream' mode;
+    each output is written in run_root as soon as it is captured
+    """
+    def __init__(self, run_root):
+        super().__init__()
+        # not a variable, see Variables.__setattr__
+        object.__setattr__(self, 'run_root', Path(run_root))
+
+    def __setitem__(self, varname, captured):
+        super().__setitem__(varname, captured)
+        (self.run_root / varname).write_text(captured + "\n")
+
+
 # using * as the first parameter forces the caller to name all arguments
 # which is a way to avoid stupid mistakes
 # the parameters that don't have a default value
@@ -93,6 +249,11 @@ def one_run(*, protocol, interference,
             scrambler_id=DEFAULT_SCRAMBLER_ID,
             tshark=False, map=False, warmup=False,
             route_sampling=False, iperf=False,
+            ping_fetch=default_ping_fetch,
+            ping_schedule=default_ping_schedule, ping_window=None,
+            settle=default_settle, stable_samples=settle_stable_samples,
+            mesh_up=False, scrambler_up=False, keep_mesh=False,
+            durations=None, pool=None, pipeline=None, journal=None,
             verbose_ssh=False, verbose_jobs=False, dry_run=False,
             run_number=None):
     """
@@ -122,6 +283,33 @@ def one_run(*, protocol, interference,
         src_ids: a list of nodes from which we will launch the ping from.
           strings or ints are OK.
         ping_messages : the number of ping packets that will be generated
+        ping_fetch: how to get the PING files back, among
+          choices_ping_fetch
+        ping_schedule: among choices_ping_schedule; with 'rounds',
+          the pings in a round run at the same time, see ping_rounds()
+        ping_window: with 'rounds', the maximal number of simultaneous
+          pings in a round; None means no limit
+        settle: among choices_settle; with 'probe', the settle phases
+          end as soon as the routes are complete and stable
+          on all nodes, see wait-for-routes in node-utilities.sh
+        stable_samples: with 'probe', how many consecutive identical
+          samples of the routing tables make them stable
+        mesh_up: the wireless network and the routing protocol are
+          still up from the previous run, so only retune uhd_siggen,
+          and settle again for at most settle_delay_retune
+        scrambler_up: with mesh_up, the scrambler has already been
+          initialized by a previous run
+        keep_mesh: leave the routing protocol and the usrp up
+          at the end, for the next run to use mesh_up
+        durations: if a dictionary is passed, it is filled with
+          the duration in seconds of each of the phases
+        pool: a NodePool, to reuse the ssh connections of previous runs;
+          if not provided, the connections are closed at the end
+        pipeline: a postprocess.Pipeline, to do the post-processing
+          in the background; one_run then returns as soon as the data
+          is acquired, and the returned value only reflects that part
+        journal: a journal.Journal, where to record this run
+          once it has completed, post-processing included
 
     """
     # set default for the nodes parameter
@@ -136,6 +324,13 @@ def one_run(*, protocol, interference,
     # need to run the protocol
     node_ids = list(set(node_ids).union(set(src_ids).union(set(dest_ids))))
 
+    ping_pairs = list(dict.fromkeys(
+        (s, d) for s in src_ids for d in dest_ids if s != d))
+    if ping_schedule == 'rounds':
+        rounds = ping_rounds(ping_pairs)
+    else:
+        rounds = [[pair] for pair in ping_pairs]
+
     if interference == "None":
         interference = None
 
@@ -159,11 +354,8 @@ def one_run(*, protocol, interference,
             srcs = " ".join(str(n) for n in src_ids)
             dests = " ".join(str(n) for n in dest_ids)
             ping_labels = [
-                f"PING {s} ➡︎ {d}"
-                for s in src_ids
-                # and on the destination
-                for d in dest_ids
-                if d != s
+                " ".join(f"PING {s} ➡︎ {d}" for s, d in round)
+                for round in rounds
             ]
 
             log_line(f"output in {run_root}")
@@ -178,6 +370,11 @@ def one_run(*, protocol, interference,
             for label in ping_labels:
                 log_line(f"{label}")
             log_line("----")
+            log_line(f"Ping schedule: {ping_schedule},"
+                     f" {len(rounds)} rounds, window={ping_window}")
+            log_line(f"Settle: {settle}, stable samples={stable_samples}")
+            log_line(f"Mesh: {'reused' if mesh_up else 'set up'},"
+                     f" {'kept' if keep_mesh else 'torn down'} at the end")
             for feature in ('warmup', 'tshark', 'map',
                             'route_sampling', 'iperf'):
                 log_line(f"Feature {feature}: {locals()[feature]}")
@@ -198,15 +395,25 @@ def one_run(*, protocol, interference,
     if dry_run:
         return True
 
-    # the nodes involved
-    faraday = SshNode(hostname=default_gateway, username=slicename,
-                      formatter=TimeHostFormatter(), verbose=verbose_ssh)
+    # whatever happens next, the previous contents are outdated
+    config = dict(protocol=protocol, interference=interference)
+    if journal is not None:
+        journal.forget(config)
+    def record(ok):
+        if ok and journal is not None:
+            journal.record(config, run_root, journal_patterns)
+
+    # the nodes involved; unless a pool is shared with
+    # other runs, the connections get closed at the end
+    own_pool = pool is None
+    if own_pool:
+        pool = NodePool(default_gateway, slicename, verbose=verbose_ssh)
+    faraday = pool.gateway
 
     # this is a python dictionary that allows to retrieve a node object
     # from an id
     node_index = {
-        id: SshNode(gateway=faraday, hostname=fitname(id), username="root",
-                    formatter=TimeHostFormatter(), verbose=verbose_ssh)
+        id: pool.node(fitname(id))
         for id in node_ids
     }
     # extracts for sources and destinations
@@ -215,10 +422,11 @@ def one_run(*, protocol, interference,
     dest_index = {id:node for (id, node) in node_index.items()
                   if id in dest_ids}
 
-    if interference:
-        node_scrambler = SshNode(
-            gateway=faraday, hostname=fitname(scrambler_id), username="root",
-            formatter=TimeHostFormatter(), verbose=verbose_ssh)
+    # whether uhd_siggen has been started on the scrambler,
+    # in this run or, with mesh_up, in a previous one
+    scrambler_on = bool(interference) or scrambler_up
+    if scrambler_on:
+        node_scrambler = pool.node(fitname(scrambler_id))
     # the global scheduler
     scheduler = Scheduler(verbose=verbose_jobs)
 
@@ -288,43 +496,7 @@ def one_run(*, protocol, interference,
     # tx_power_in_mBm not in dBm
     tx_power_driver = tx_power * 100
 
-    #just in case somme services failed in the previous experiment
-    reset_failed_services_job = [
-        SshJob(
-            node=node,
-            verbose=verbose_jobs,
-            label="reset failed services",
-            command=Run("systemctl reset-failed",
-                        label="reset-failed services"))
-        for id, node in node_index.items()
-    ]
-    reset_failed_services = Scheduler(
-        *reset_failed_services_job,
-        scheduler=scheduler,
-        required=green_light,
-        verbose=verbose_jobs,
-        label="Reset failed services")
-    init_wireless_sshjobs = [
-        SshJob(
-            node=node,
-            verbose=verbose_jobs,
-            label=f"init {id}",
-            command=RunScript(
-                "node-utilities.sh",
-                f"init-ad-hoc-network-{WIRELESS_DRIVER}",
-                WIRELESS_DRIVER, "foobar", frequency, phy_rate,
-                antenna_mask, tx_power_driver,
-                label="init add-hoc network"),
-        )
-        for id, node in node_index.items()]
-    init_wireless_jobs = Scheduler(
-        *init_wireless_sshjobs,
-        scheduler=scheduler,
-        required=green_light,
-        verbose=verbose_jobs,
-        label="Initialisation of wireless chips")
-
-    if interference:
+    if interference and not mesh_up:
         # Run uhd_siggen with the chosen power
         init_scrambler_job = SshJob(
             scheduler=scheduler,
@@ -343,31 +515,95 @@ def one_run(*, protocol, interference,
                           label="systemctl start uhd_siggen")
                       ]
         )
-
-    green_light = [init_wireless_jobs, reset_failed_services]
-    # then install and run batman on fit nodes
-    run_protocol_job = [
-        SshJob(
-            # scheduler=scheduler,
-            node=node,
-            label=f"init and run {protocol} on fit node {id}",
+    elif interference:
+        # the mesh is up, only retune uhd_siggen; no -t here so that
+        # the job ends as soon as uhd_siggen is started, and the
+        # re-settle can wait for the new interference level
+        commands = []
+        if not scrambler_up:
+            commands.append(RunScript("node-utilities.sh",
+                                      "init-scrambler",
+                                      label="init scrambler"))
+        commands.append(Run(f"systemd-run --unit=uhd_siggen",
+                            f"uhd_siggen -a usrp -f {frequency}M",
+                            f"--sine --amplitude 0.{interference}",
+                            label="systemctl start uhd_siggen"))
+        retune_scrambler_job = SshJob(
+            scheduler=scheduler,
+            required=green_light,
+            node=node_scrambler,
             verbose=verbose_jobs,
-            # CAREFUL : These ones use sytemd-run
-            #            with the ----service-type=forking option!
-            command=RunScript("node-utilities.sh",
-                              f"run-{protocol}",
-                              label=f"run {protocol}"),
+            label=f"retune uhd_siggen to {interference}",
+            commands=commands,
         )
-        for id, node in node_index.items()]
+        green_light = retune_scrambler_job
+
+    if mesh_up:
+        # the wireless interfaces and the routing protocol
+        # are still up from the previous run
+        mesh_ready = green_light
+    else:
+        #just in case somme services failed in the previous experiment
+        reset_failed_services_job = [
+            SshJob(
+                node=node,
+                verbose=verbose_jobs,
+                label="reset failed services",
+                command=Run("systemctl reset-failed",
+                            label="reset-failed services"))
+            for id, node in node_index.items()
+        ]
+        reset_failed_services = Scheduler(
+            *reset_failed_services_job,
+            scheduler=scheduler,
+            required=green_light,
+            verbose=verbose_jobs,
+            label="Reset failed services")
+        init_wireless_sshjobs = [
+            SshJob(
+                node=node,
+                verbose=verbose_jobs,
+                label=f"init {id}",
+                command=RunScript(
+                    "node-utilities.sh",
+                    f"init-ad-hoc-network-{WIRELESS_DRIVER}",
+                    WIRELESS_DRIVER, "foobar", frequency, phy_rate,
+                    antenna_mask, tx_power_driver,
+                    label="init add-hoc network"),
+            )
+            for id, node in node_index.items()]
+        init_wireless_jobs = Scheduler(
+            *init_wireless_sshjobs,
+            scheduler=scheduler,
+            required=green_light,
+            verbose=verbose_jobs,
+            label="Initialisation of wireless chips")
 
-    run_protocol = Scheduler(
-        *run_protocol_job,
-        scheduler=scheduler,
-        required=green_light,
-        verbose=verbose_jobs,
-        label="init and run routing protocols")
+        green_light = [init_wireless_jobs, reset_failed_services]
+        # then install and run batman on fit nodes
+        run_protocol_job = [
+            SshJob(
+                # scheduler=scheduler,
+                node=node,
+                label=f"init and run {protocol} on fit node {id}",
+                verbose=verbose_jobs,
+                # CAREFUL : These ones use sytemd-run
+                #            with the ----service-type=forking option!
+                command=RunScript("node-utilities.sh",
+                                  f"run-{protocol}",
+                                  label=f"run {protocol}"),
+            )
+            for id, node in node_index.items()]
 
-    green_light = run_protocol
+        run_protocol = Scheduler(
+            *run_protocol_job,
+            scheduler=scheduler,
+            required=green_light,
+            verbose=verbose_jobs,
+            label="init and run routing protocols")
+
+        green_light = run_protocol
+        mesh_ready = run_protocol
 
     # after that, run tcpdump on fit nodes, this job never ends...
     if tshark:
@@ -397,6 +633,34 @@ def one_run(*, protocol, interference,
             verbose=verbose_jobs,
             label="Monitoring - tcpdumps")
 
+    def settle_job(message, delay, suffix, **kwds):
+        """
+        the job that lets the wireless network settle, for delay
+        seconds with 'fixed', or at most delay seconds with 'probe'
+        kwds are passed to the job, e.g. scheduler or required
+        """
+        if settle == 'fixed':
+            return PrintJob(
+                message, sleep=delay,
+                label=f"settling{suffix} for {delay} sec", **kwds)
+        return Scheduler(
+            *[
+                SshJob(
+                    node=node,
+                    label=f"wait for {protocol} routes on fit node {id}",
+                    verbose=verbose_jobs,
+                    command=RunScript(
+                        "node-utilities.sh", "wait-for-routes",
+                        protocol, len(node_index) - 1,
+                        stable_samples, settle_probe_period, delay,
+                        label="wait for routes"),
+                )
+                for id, node in node_index.items()
+            ],
+            verbose=verbose_jobs,
+            label=f"settling{suffix} - at most {delay} sec",
+            **kwds)
+
     # let the wireless network settle
     settle_scheduler = Scheduler(
         scheduler=scheduler,
@@ -433,22 +697,20 @@ def one_run(*, protocol, interference,
             scheduler=settle_scheduler,
             verbose=verbose_jobs,
             label="Warmup pings")
-        settle_wireless_job2 = PrintJob(
+        settle_wireless_job2 = settle_job(
             "Let the wireless network settle after warmup",
-            sleep=settle_delay_shorter,
+            settle_delay_shorter, "-warmup",
             scheduler=settle_scheduler,
-            required=warmup_scheduler,
-            label=f"settling-warmup for {settle_delay_shorter} sec")
+            required=warmup_scheduler)
 
     # this is a little cheating; could have gone before the bloc above
     # but produces a nicer graphical output
     # we might want to help asynciojobs if it offered a means
     # to specify entry and exit jobs in a scheduler
-    settle_wireless_job = PrintJob(
+    settle_wireless_job = settle_job(
         "Let the wireless network settle",
-        sleep=settle_delay_long,
-        scheduler=settle_scheduler,
-        label=f"settling for {settle_delay_long} sec")
+        settle_delay_retune if mesh_up else settle_delay_long, "",
+        scheduler=settle_scheduler)
 
     green_light = settle_scheduler
 
@@ -538,12 +800,11 @@ def one_run(*, protocol, interference,
             required=green_light,
             verbose=verbose_jobs,
             label="Iperf Module")
-        settle_wireless_job_iperf = PrintJob(
+        settle_wireless_job_iperf = settle_job(
             "Let the wireless network settle",
-            sleep=settle_delay_shorter,
+            settle_delay_shorter, "-iperf",
             scheduler=scheduler,
-            required=iperf_sched,
-            label=f"settling-iperf for {settle_delay_shorter} sec")
+            required=iperf_sched)
 
         green_light = settle_wireless_job_iperf
 
@@ -613,29 +874,38 @@ def one_run(*, protocol, interference,
     # to the scheduler, we will add them later on
     # depending on the sequential/parallel strategy
 
+    def ping_commands(s, d):
+        ping_file = f"PING-{s:02d}-{d:02d}"
+        ping_args = ["node-utilities.sh", "my-ping",
+                     f"10.0.0.{d}",
+                     ping_timeout, ping_interval,
+                     ping_size, ping_messages,
+                     f"actual {s} ➡︎ {d}"]
+        if ping_fetch == 'stream':
+            # no file on the node, and no sftp session
+            return [RunScript(*ping_args, label="",
+                              capture=Capture(ping_file, ping_outputs))]
+        ping = RunScript(*ping_args, ">", ping_file, label="")
+        if ping_fetch == 'batch':
+            return [ping]
+        return [ping,
+                Pull(remotepaths=[ping_file],
+                     localpath=str(run_root),
+                     label="")]
+
+    ping_outputs = PingOutputs(run_root)
     pings_job = [
         SshJob(
-            node=node_s,
+            node=src_index[s],
             verbose=verbose_jobs,
             commands=[
                 Run(f"echo actual ping {s} ➡︎ {d} using {protocol}",
                     label=f"ping {s} ➡︎ {d}"),
-                RunScript("node-utilities.sh", "my-ping",
-                          f"10.0.0.{d}",
-                          ping_timeout, ping_interval,
-                          ping_size, ping_messages,
-                          f"actual {s} ➡︎ {d}",
-                          ">", f"PING-{s:02d}-{d:02d}",
-                          label=""),
-                Pull(remotepaths=[f"PING-{s:02d}-{d:02d}"],
-                     localpath=str(run_root),
-                     label=""),
+                *ping_commands(s, d),
             ],
         )
         # for each selected experiment nodes
-        for s, node_s in src_index.items()
-        for d, node_d in dest_index.items()
-        if s != d
+        for s, d in ping_pairs
     ]
     pings = Scheduler(
         scheduler=scheduler,
@@ -644,7 +914,7 @@ def one_run(*, protocol, interference,
         required=green_light)
 
     # retrieve all pcap files from fit nodes
-    stop_protocol_job = [
+    stop_protocol_job = [] if keep_mesh else [
         SshJob(
             # scheduler=scheduler,
             node=node,
@@ -657,12 +927,35 @@ def one_run(*, protocol, interference,
         )
         for id, node in node_index.items()
     ]
-    stop_protocol = Scheduler(
-        *stop_protocol_job,
-        scheduler=scheduler,
-        required=pings,
-        label="Stop routing protocols",
-    )
+    if stop_protocol_job:
+        stop_protocol = Scheduler(
+            *stop_protocol_job,
+            scheduler=scheduler,
+            required=pings,
+            label="Stop routing protocols",
+        )
+
+    if ping_fetch == 'batch':
+        # one sftp session per source
+        destinations_by_source = itertools.groupby(ping_pairs,
+                                                   key=lambda pair: pair[0])
+        retrieve_pings = Scheduler(
+            *[
+                SshJob(
+                    node=src_index[s],
+                    label=f"retrieve PING files from fit{s:02d}",
+                    verbose=verbose_jobs,
+                    command=Pull(
+                        remotepaths=[f"PING-{s:02d}-{d:02d}"
+                                     for _, d in pairs],
+                        localpath=str(run_root), label=""),
+                )
+                for s, pairs in destinations_by_source
+            ],
+            scheduler=scheduler,
+            required=pings,
+            label="Retrieve PING files",
+        )
 
     if tshark:
         retrieve_tcpdump_job = [
@@ -724,35 +1017,6 @@ def one_run(*, protocol, interference,
             verbose=verbose_jobs,
             label="Stop & retrieve route sampling",
             )
-    if tshark:
-        parse_pcaps_job = [
-            SshJob(
-                # scheduler=scheduler,
-                node=LocalNode(),
-                # required=retrieve_tcpdump,
-                label=f"parse pcap trace {run_root}/fit{i}.pcap",
-                verbose=verbose_jobs,
-                #commands = [RunScript("parsepcap.sh", run_root, i)]
-                command=Run("tshark", "-2", "-r",
-                            f"{run_root}/fit{i}.pcap",
-                            "-R",
-                            f"'(ip.dst==10.0.0.{i} && icmp) && radiotap.dbm_antsignal'",
-                            "-Tfields",
-                            "-e", "'ip.src'",
-                            "-e" "'ip.dst'",
-                            "-e", "'radiotap.dbm_antsignal'",
-                            ">", f"{run_root}/result-{i}.txt",
-                            label=f"parsing pcap from {i}"),
-            )
-            for i in node_ids
-        ]
-        parse_pcaps = Scheduler(
-            *parse_pcaps_job,
-            scheduler=scheduler,
-            required=retrieve_tcpdump,
-            label="Parse pcap",
-        )
-
     if interference:
         kill_uhd_siggen = SshJob(
             scheduler=scheduler,
@@ -764,20 +1028,49 @@ def one_run(*, protocol, interference,
                       #Run("systemctl reset-failed tcpdump"),
                       ],
         )
+    # with keep_mesh the usrp remains on for the next interference level
+    if scrambler_on and not keep_mesh:
         kill_2_uhd_siggen = SshJob(
             scheduler=scheduler,
             node=faraday,
-            required=kill_uhd_siggen,
+            required=kill_uhd_siggen if interference else pings,
             label=f"turning off usrp on the scrambler node {scrambler_id}",
             verbose=verbose_jobs,
             command=Run("rhubarbe", "usrpoff", scrambler_id),
         )
 
-    pings.add(Sequence(*pings_job))
+    if ping_schedule == 'rounds':
+        # rounds run one after the other, and all the pings
+        # in a round at the same time, up to ping_window
+        jobs_by_pair = dict(zip(ping_pairs, pings_job))
+        pings.add(Sequence(*[
+            Scheduler(*[jobs_by_pair[pair] for pair in round],
+                      jobs_window=ping_window,
+                      verbose=verbose_jobs,
+                      label=f"ping round {number}")
+            for number, round in enumerate(rounds, 1)
+        ]))
+    else:
+        pings.add(Sequence(*pings_job))
     # for running sequentially we impose no limit on the scheduler
     # that will be limitied anyways by the very structure
     # of the required graph
 
+    # keep track of when each phase ends
+    if durations is None:
+        durations = {}
+    timestamps = {}
+    async def timestamp(key):
+        timestamps[key] = time.time()
+    Job(timestamp('setup'), scheduler=scheduler, required=mesh_ready,
+        label="setup done")
+    Job(timestamp('settle'), scheduler=scheduler, required=settle_scheduler,
+        label="settle done")
+    Job(timestamp('extras'), scheduler=scheduler, required=green_light,
+        label="pings start")
+    Job(timestamp('pings'), scheduler=scheduler, required=pings,
+        label="pings done")
+
     # safety check
 
     scheduler.export_as_pngfile(run_root / "experiment-graph")
@@ -786,41 +1079,71 @@ def one_run(*, protocol, interference,
         return True
 
     # if not in dry-run mode, let's proceed to the actual experiment
-    ok = scheduler.run()  # jobs_window=jobs_window)
-
-    # close all ssh connections
-    close_ssh_in_scheduler(scheduler)
+    beginning = time.time()
+    ok = pool.run(scheduler)  # jobs_window=jobs_window)
+    timestamps['wrap-up'] = time.time()
 
 
     # give details if it failed
     if not ok:
         scheduler.debrief()
         scheduler.export_as_pngfile("debug")
-    if ok and map:
-        time_line("Creation of MAP files")
-        post_processor = ProcessRoutes(run_root, src_ids, node_ids)
-        post_processor.run()
-    if ok and route_sampling:
-        time_line("Creation of ROUTE SAMPLING files")
-        post_processor = ProcessRoutes(run_root, src_ids, node_ids)
-        post_processor.run_sampled()
-    # data acquisition is done, let's aggregate results
-    # i.e. compute averages
-    #if ok and tshark:
-        #post_processor = Aggregator(run_root, node_ids, antenna_mask)
-        #post_processor.run()
-
-    time_line("one_run done")
+        if keep_mesh:
+            # the next run will start from scratch
+            stop_mesh(pool, protocol, node_index,
+                      scrambler_id, node_scrambler if scrambler_on else None,
+                      verbose_jobs)
+    # close all ssh connections
+    if own_pool:
+        pool.close()
+    # data acquisition is done, let's compute routes, RSSIs,
+    # and the PING store, see postprocess.py
+    post_kwds = dict(
+        node_ids=node_ids, src_ids=src_ids,
+        antenna_mask=antenna_mask,
+        map=map, route_sampling=route_sampling, tshark=tshark)
+    if pipeline is not None:
+        # this also takes care of the manifest and the journal
+        pipeline.submit(run_name, run_root, ok, durations,
+                        on_done=record, **post_kwds)
+    else:
+        if ok:
+            time_line("Post-processing")
+            ok = post_process(run_root, **post_kwds)
+            timestamps['post-processing'] = time.time()
+        # describe what we have in the run_name manifest
+        update_manifest(run_name, run_root)
+        record(ok)
+
+    # the duration of each phase; missing ones were not reached
+    previous = beginning
+    for phase in phases:
+        if phase in timestamps:
+            durations[phase] = timestamps[phase] - previous
+            previous = timestamps[phase]
+    summary = phases_summary(durations)
+    with trace.open('a') as feed:
+        time_line(f"Phases: {summary}", file=feed)
+    time_line(f"one_run done - {summary}")
     return ok
 
 
 # same as for interference, we force all arguments to be named
-def all_runs(*args, interferences, protocols,
-             **kwds):
+def all_runs(*args, interferences, protocols, sweep=default_sweep,
+             pipeline=True, resume=False, **kwds):
     """
     calls one_run with the cartesian product of
     protocols, interferences
 
+    with sweep='keep-mesh', the runs for a given protocol
+    share the same mesh, see mesh_up and keep_mesh in one_run
+
+    with pipeline, each run is post-processed in the background
+    while the next one is acquiring its data
+
+    the completed runs are recorded in the journal of run_name;
+    with resume, the ones that are already in there are skipped
+
     All other arguments to one_run may/must be specified as well
 
     Example:
@@ -832,14 +1155,38 @@ def all_runs(*args, interferences, protocols,
     # we don't use all() on a list comprehension because
     # (*) we want to run all configs regardless of a failure, and
     #     all() is lazy and would stop at the first failure
-    # (*) we need to set load_images to false after the first run
+    # (*) we need to set load_images to false after the first
+    #     successful run
     overall = True
     if interferences is None:
         interferences = ["None"]
-    iterator = itertools.product(protocols, interferences)
-    for (run_number, (protocol, interference)) \
-            in enumerate(iterator, 1):
-        if not one_run(
+    journal = Journal(kwds.get('run_name', default_run_name))
+    configs = []
+    for protocol, interference in itertools.product(protocols, interferences):
+        config = dict(protocol=protocol, interference=interference)
+        if resume and journal.is_completed(config):
+            time_line(f"Skipping protocol={protocol}"
+                      f" interference={interference} - already completed")
+        else:
+            configs.append((protocol, interference))
+    keep = sweep == 'keep-mesh'
+    # whether the previous run has left the mesh / the scrambler up
+    mesh_up = scrambler_up = False
+    # (protocol, interference, ok, durations) for the summary
+    summary = []
+    # the ssh connections are shared by all runs
+    pool = NodePool(default_gateway,
+                    kwds.get('slicename', default_slicename),
+                    verbose=kwds.get('verbose_ssh', False))
+    post_processor = Pipeline() if pipeline else None
+    with pool:
+        for run_number, (protocol, interference) \
+                in enumerate(configs, 1):
+            # the last interference for this protocol tears the mesh down
+            keep_mesh = keep and (run_number < len(configs)
+                                  and configs[run_number][0] == protocol)
+            durations = {}
+            ok = one_run(
                 protocol=protocol,
                 interference=interference,
                 tx_power=TX_POWER,
@@ -847,10 +1194,42 @@ def all_runs(*args, interferences, protocols,
                 antenna_mask=ANTENNA_MASK,
                 channel=CHANNEL,
                 run_number=run_number,
-                *args, **kwds):
-            overall = False
-        # make sure images will get loaded only once
-        kwds['load_images'] = False
+                mesh_up=mesh_up,
+                scrambler_up=scrambler_up,
+                keep_mesh=keep_mesh,
+                durations=durations,
+                pool=pool,
+                pipeline=post_processor,
+                journal=journal,
+                *args, **kwds)
+            if not ok:
+                overall = False
+            summary.append((protocol, interference, ok, durations))
+            # a failed run has torn down the mesh
+            mesh_up = keep_mesh and ok
+            scrambler_up = mesh_up and (
+                scrambler_up or interference not in (None, "None"))
+            # make sure images will get loaded only once
+            if ok:
+                kwds['load_images'] = False
+
+    if post_processor is not None:
+        time_line("Waiting for post-processing")
+        with post_processor:
+            overall = post_processor.join() and overall
+
+    if kwds.get('dry_run'):
+        return overall
+    time_line(f"Sweep summary ({sweep})")
+    totals = {}
+    for protocol, interference, ok, durations in summary:
+        print(f"{protocol:>6} {str(interference):>4}"
+              f" {'OK' if ok else 'KO'}:"
+              f" {phases_summary(durations)}")
+        for phase, duration in durations.items():
+            totals[phase] = totals.get(phase, 0) + duration
+    print(f"{'total':>14}: {phases_summary(totals)}"
+          f" - overall {sum(totals.values()):.0f}s")
     return overall
 
 
@@ -945,8 +1324,8 @@ def main():
         help="observe and recolt the routing table over time during the experiment")
     parser.add_argument(
         "--tshark", default=False, action='store_true',
-        help="parse pcap files to get RSSIs for each nodes"
-             " (Warning: you need to have tshark installed on your machine)")
+        help="capture and parse pcap files to get RSSIs for each nodes"
+             " (parsing is done locally by pcaprssi.py, no need for tshark)")
     parser.add_argument(
         "--all-extras", default=False, action='store_true',
         help="enable 4 extra features: warmup, iperf, "
@@ -955,6 +1334,60 @@ def main():
              " and thus performs MUCH more slowly."
     )
 
+    parser.add_argument(
+        "--ping-fetch", default=default_ping_fetch,
+        choices=choices_ping_fetch,
+        help="how to get the ping outputs back: pull one file per pair,"
+             " stream them from the ssh channel, or batch"
+             " one pull per source at the end")
+
+    parser.add_argument(
+        "--ping-schedule", default=default_ping_schedule,
+        choices=choices_ping_schedule,
+        help="run the pings one at a time, or in rounds of simultaneous"
+             " pings where each node is involved in at most one ping")
+    parser.add_argument(
+        "--ping-window", default=None, type=int,
+        help="with --ping-schedule rounds, the maximal number"
+             " of simultaneous pings - default is no limit")
+
+    parser.add_argument(
+        "--settle", default=default_settle, choices=choices_settle,
+        help=f"let the network settle for a fixed time, or probe"
+             f" the routing tables until they are complete and stable,"
+             f" for at most the same time"
+             f" ({settle_delay_long}s, or {settle_delay_shorter}s"
+             f" after warmup and iperf)")
+    parser.add_argument(
+        "--stable-samples", default=settle_stable_samples, type=int,
+        help=f"with --settle probe, the number of consecutive identical"
+             f" samples, taken every {settle_probe_period}s,"
+             f" that make the routes stable")
+
+    parser.add_argument(
+        "--sweep", default=default_sweep, choices=choices_sweep,
+        help=f"set up and tear down the mesh for each run, or keep it"
+             f" up for all the interference levels of a protocol,"
+             f" and only retune the scrambler in between, with a"
+             f" re-settle of at most {settle_delay_retune}s")
+
+    parser.add_argument(
+        "--no-pipeline", dest='pipeline', default=True,
+        action='store_false',
+        help="post-process each run before starting the next one,"
+             " instead of in the background")
+
+    parser.add_argument(
+        "--resume", default=False, action='store_true',
+        help="skip the protocol x interference combinations that"
+             " have already completed, as recorded in the journal"
+             " of the output directory")
+
+    parser.add_argument(
+        "--reprocess", metavar='run-dir', default=None, nargs='+',
+        help="do not run anything, just redo the post-processing"
+             " of existing run directories, using all local cores")
+
     parser.add_argument(
         "-n", "--dry-run", default=False, action='store_true',
         help="do not run anything, just print out scheduler,"
@@ -968,6 +1401,9 @@ def main():
 
     args = parser.parse_args()
 
+    if args.reprocess:
+        return reprocess(*args.reprocess)
+
     # special 'all' options
     if args.all_src:
         args.src_ids = args.node_ids
@@ -985,6 +1421,9 @@ def main():
     return all_runs(
         protocols=args.protocol,
         interferences=args.interference,
+        sweep=args.sweep,
+        pipeline=args.pipeline,
+        resume=args.resume,
         run_name=args.run_name,
         slicename=args.slicename,
         load_images=args.load_images,
@@ -998,6 +1437,11 @@ def main():
         warmup=args.warmup,
         route_sampling=args.route_sampling,
         iperf=args.iperf,
+        ping_fetch=args.ping_fetch,
+        ping_schedule=args.ping_schedule,
+        ping_window=args.ping_window,
+        settle=args.settle,
+        stable_samples=args.stable_samples,
 
         verbose_ssh=args.verbose_ssh,
         verbose_jobs=args.debug,
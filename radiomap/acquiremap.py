@@ -7,21 +7,26 @@ See visumap.ipynb for how to use it
 
 # pylint: disable=c0111, c0103, c0326, r0913, r0914
 
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from pathlib import Path
 
-from asynciojobs import Scheduler, Sequence, PrintJob
+from asynciojobs import Scheduler, Sequence, PrintJob, Job
 
-from apssh import SshNode, SshJob
+from apssh import SshJob
 from apssh import Run, RunScript, Pull
-from apssh import TimeHostFormatter
 
 # make sure to pip install r2lab
 from r2lab import ListOfChoices
 
 # helpers
 from processmap import Aggregator
+from pcaprssi import write_result
 from channels import channel_frequency
+from nodepool import NodePool
+from journal import Journal
 
 ##########
 default_gateway      = 'faraday.inria.fr'
@@ -56,6 +61,12 @@ ping_timeout = 1
 ping_size = 64
 ping_interval = 0.015
 ping_number = 500
+# roughly how long one ping job takes, ssh overhead excluded
+ping_duration = ping_number * ping_interval
+
+# the files that make a run complete, see journal.py
+# RSSI.npy and the .npz files are left out, as they get rebuilt
+journal_patterns = ["fit*.pcap", "result-*.txt", "RSSI.txt"]
 
 # convenience
 
@@ -68,6 +79,41 @@ def fitname(node_id):
     return "fit{:02d}".format(int_id)
 
 
+def tournament_rounds(node_ids):
+    """
+    the round-robin tournament schedule of all (i, j) couples
+    with i < j, i.e. a list of rounds where no node appears twice;
+    uses the circle method, so that n nodes take n-1 rounds
+    if n is even, and n rounds otherwise
+    """
+    nodes = sorted(node_ids)
+    # an odd number of nodes means one rests at each round
+    if len(nodes) % 2:
+        nodes.append(None)
+    nb_nodes = len(nodes)
+    fixed, rotating = nodes[:1], nodes[1:]
+    rounds = []
+    for _ in range(nb_nodes - 1):
+        circle = fixed + rotating
+        couples = [(circle[k], circle[nb_nodes - 1 - k])
+                   for k in range(nb_nodes // 2)]
+        rounds.append(sorted((min(i, j), max(i, j)) for i, j in couples
+                             if i is not None and j is not None))
+        rotating = rotating[-1:] + rotating[:-1]
+    return [round for round in rounds if round]
+
+
+def expected_duration(rounds, parallel):
+    """
+    a rough estimate of the time needed to run the pings,
+    given as a list of rounds, with at most parallel simultaneous
+    pings in a round - 0 or None means no limit
+    """
+    if not parallel:
+        return len(rounds) * ping_duration
+    return sum(-(-len(round) // parallel) for round in rounds) * ping_duration
+
+
 def naming_scheme(run_name, tx_power, phy_rate, antenna_mask, channel,
                   autocreate=False):
     """
@@ -87,11 +133,92 @@ def naming_scheme(run_name, tx_power, phy_rate, antenna_mask, channel,
     return run_root
 
 
+def post_process(run_root, node_ids, antenna_mask, wireless_driver):
+    """
+    extract the RSSIs from the pcap files, and aggregate them
+    in RSSI.txt; returns the time when it is done
+    """
+    # extract RSSIs locally, rather than with tshark on the nodes
+    for i in node_ids:
+        write_result(run_root / "fit{}.pcap".format(i),
+                     run_root / "result-{}.txt".format(i), i)
+    post_processor = Aggregator(run_root, node_ids, antenna_mask, wireless_driver)
+    post_processor.run()
+    return time.time()
+
+
+class Pipeline:
+    """
+    post-processing in a pool of processes during a sweep, so that
+    the acquisition of the next run can start right away
+
+    the workers are started from a forkserver, as forking this
+    process, with its ssh connections and threads, is unsafe
+
+    this is a smaller cousin of postprocess.Pipeline in batman-vs-olsr/,
+    that demo directory is not importable from here; the post-processing
+    of a radiomap run is a single function, so there is no need
+    for the per-run threads
+    """
+
+    def __init__(self, max_workers=None):
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('forkserver'))
+        # (run_root, submission time, future)
+        self.runs = []
+
+    def submit(self, run_root, *args, on_done=None):
+        """
+        arguments are the ones of post_process; on_done, if provided,
+        is called with a boolean that tells whether it went fine
+        """
+        future = self.executor.submit(post_process, run_root, *args)
+        if on_done is not None:
+            future.add_done_callback(
+                lambda future: on_done(future.exception() is None))
+        self.runs.append((run_root, time.time(), future))
+
+    def join(self):
+        """
+        wait for all the runs submitted so far, and
+        tell when each one was done
+
+        returns True if all went fine
+        """
+        overall = True
+        for run_root, submitted, future in self.runs:
+            try:
+                done, ok = future.result(), True
+            except Exception as exc:                    # pylint: disable=w0703
+                print("post-processing {} failed: {}".format(run_root, exc))
+                done, ok = time.time(), False
+            overall = overall and ok
+            print("{}: {} - acquired at {}, post-processed at {} (+{:.0f}s)"
+                  .format(run_root, "OK" if ok else "KO",
+                          time.strftime("%H-%M-%S", time.localtime(submitted)),
+                          time.strftime("%H-%M-%S", time.localtime(done)),
+                          done - submitted))
+        self.runs = []
+        return overall
+
+    def close(self):
+        self.join()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def one_run(wireless_driver,
             tx_power, phy_rate, antenna_mask, channel, *,
             run_name=default_run_name, slicename=default_slicename,
             load_images=False, node_ids=None,
-            parallel=None,
+            parallel=None, rounds=False, pool=None, pipeline=None,
+            journal=None,
             verbose_ssh=False, verbose_jobs=False, dry_run=False):
     """
     Performs data acquisition on all nodes with the following settings
@@ -111,6 +238,16 @@ def one_run(wireless_driver,
         parallel: a number of simulataneous jobs to run
                   1 means all data acquisition is sequential (default)
                   0 means maximum parallel
+        rounds: if set, pings are run in rounds where each node is
+                involved in only one ping, see tournament_rounds();
+                parallel then is a limit within each round
+        pool: a NodePool, to reuse the ssh connections of previous runs;
+              if not provided, the connections are closed at the end
+        pipeline: a Pipeline, to do the post-processing in the background;
+                  one_run then returns as soon as the data is acquired,
+                  and the returned value only reflects that part
+        journal: a journal.Journal, where to record this run
+                 once it has completed, post-processing included
     """
 
     #
@@ -136,15 +273,26 @@ def one_run(wireless_driver,
     run_root = naming_scheme(run_name, tx_power, phy_rate,
                              antenna_mask, channel, autocreate=True)
 
-    # the nodes involved
-    faraday = SshNode(hostname=default_gateway, username=slicename,
-                      formatter=TimeHostFormatter(), verbose=verbose_ssh)
+    # whatever happens next, the previous contents are outdated
+    config = dict(tx_power=tx_power, phy_rate=phy_rate,
+                  antenna_mask=antenna_mask, channel=channel)
+    if journal is not None:
+        journal.forget(config)
+    def record(ok):
+        if ok and journal is not None:
+            journal.record(config, run_root, journal_patterns)
+
+    # the nodes involved; unless a pool is shared with
+    # other runs, the connections get closed at the end
+    own_pool = pool is None
+    if own_pool:
+        pool = NodePool(default_gateway, slicename, verbose=verbose_ssh)
+    faraday = pool.gateway
 
     # this is a python dictionary that allows to retrieve a node object
     # from an id
     node_index = {
-        id: SshNode(gateway=faraday, hostname=fitname(id), username="root",
-                    formatter=TimeHostFormatter(), verbose=verbose_ssh)
+        id: pool.node(fitname(id))
         for id in node_ids
     }
 
@@ -244,10 +392,12 @@ def one_run(wireless_driver,
     # to the scheduler, we will add them later on
     # depending on the sequential/parallel strategy
 
+    # with rounds, the pings go in nested schedulers
+    # so they can't require a job in the main one
     pings = [
         SshJob(
             node=nodei,
-            required=settle_wireless_job,
+            required=None if rounds else settle_wireless_job,
             label="ping {} -> {}".format(i, j),
             verbose=verbose_jobs,
             commands=[
@@ -268,21 +418,36 @@ def one_run(wireless_driver,
         if j > i
     ]
 
+    if rounds:
+        # a sequence of rounds, all pings in a round at the same time
+        ping_rounds = tournament_rounds(node_index.keys())
+        # same order as pings
+        couples = [(i, j) for i in node_index for j in node_index if j > i]
+        jobs_by_couple = dict(zip(couples, pings))
+        round_schedulers = [
+            Scheduler(*[jobs_by_couple[couple] for couple in round],
+                      jobs_window=parallel or None,
+                      verbose=verbose_jobs,
+                      label="ping round {}".format(number))
+            for number, round in enumerate(ping_rounds, 1)
+        ]
+        pings_done = round_schedulers[-1:]
+    else:
+        pings_done = pings
+
     # retrieve all pcap files from fit nodes
     retrieve_tcpdump = [
         SshJob(
             scheduler=scheduler,
             node=nodei,
-            required=pings,
+            required=pings_done,
             label="retrieve pcap trace from fit{:02d}".format(i),
             verbose=verbose_jobs,
             commands=[
                 Run("sleep 1;pkill tcpdump; sleep 1"),
-                RunScript("node-utilities.sh", "process-pcap", i),
                 Run(
-                    "echo retrieving pcap trace and result-{i}.txt from fit{i:02d}".format(i=i)),
-                Pull(remotepaths=["/tmp/fit{}.pcap".format(i),
-                                  "/tmp/result-{}.txt".format(i)],
+                    "echo retrieving pcap trace from fit{i:02d}".format(i=i)),
+                Pull(remotepaths=["/tmp/fit{}.pcap".format(i)],
                      localpath=str(run_root)),
             ]
         )
@@ -291,7 +456,14 @@ def one_run(wireless_driver,
 
     # xxx this is a little fishy
     # should we not just consider that the default is parallel=1 ?
-    if parallel is None:
+    if rounds:
+        # the Sequence adds the required relationships between rounds
+        scheduler.add(Sequence(*round_schedulers,
+                               required=settle_wireless_job,
+                               scheduler=scheduler))
+        jobs_window = None
+        expected = expected_duration(ping_rounds, parallel)
+    elif parallel is None:
         # with the sequential strategy, we just need to
         # create a Sequence out of the list of pings
         # Sequence will add the required relationships
@@ -300,6 +472,7 @@ def one_run(wireless_driver,
         # that will be limitied anyways by the very structure
         # of the required graph
         jobs_window = None
+        expected = expected_duration([[ping] for ping in pings], None)
     else:
         # with the parallel strategy
         # we just need to insert all the ping jobs
@@ -308,30 +481,57 @@ def one_run(wireless_driver,
         # this time the value in parallel is the one
         # to use as the jobs_limit; if 0 then inch'allah
         jobs_window = parallel
+        expected = expected_duration([pings], parallel)
+
+    # keep track of when the pings actually start and end
+    timestamps = {}
+    async def timestamp(key):
+        timestamps[key] = time.time()
+    Job(timestamp('start'), scheduler=scheduler, required=settle_wireless_job,
+        label="pings start")
+    Job(timestamp('end'), scheduler=scheduler, required=pings_done,
+        label="pings end")
 
     # if not in dry-run mode, let's proceed to the actual experiment
     scheduler.jobs_limit = jobs_window
-    ok = scheduler.orchestrate()
+    ok = pool.run(scheduler)
+    if own_pool:
+        pool.close()
     # give details if it failed
     if not ok:
         scheduler.debrief()
+    if 'start' in timestamps and 'end' in timestamps:
+        print("{} pings: expected {:.0f}s, actual {:.0f}s"
+              .format(len(pings), expected,
+                      timestamps['end'] - timestamps['start']))
 
     # data acquisition is done, let's aggregate results
     # i.e. compute averages
     if ok:
-        post_processor = Aggregator(run_root, node_ids, antenna_mask, wireless_driver)
-        post_processor.run()
+        if pipeline is not None:
+            pipeline.submit(run_root, node_ids, antenna_mask, wireless_driver,
+                            on_done=record)
+        else:
+            post_process(run_root, node_ids, antenna_mask, wireless_driver)
+            record(True)
 
     return ok
 
 
 def all_runs(wireless_driver,
-             tx_powers, phy_rates, antenna_masks, channels, *args, **kwds):
+             tx_powers, phy_rates, antenna_masks, channels, *args,
+             pipeline=True, resume=False, **kwds):
     """
     calls one_run with the cartesian product of
     tx_powers, phy_rates, antenna_masks and channels, that are expected to
     be lists of strings
 
+    with pipeline, each run is post-processed in the background
+    while the next one is acquiring its data
+
+    the completed runs are recorded in the journal of run_name;
+    with resume, the ones that are already in there are skipped
+
     All other arguments to one_run may/must be specified as well
 
     Example:
@@ -341,23 +541,47 @@ def all_runs(wireless_driver,
     # we don't use all() on a list comprehension because
     # (*) we want to run all configs regardless of a failure, and
     #     all() is lazy and would stop at the first failure
-    # (*) we need to set load_images to false after the first run
+    # (*) we need to set load_images to false after the first
+    #     successful run
 
     # Warning, for Intel 5300 card, 3 antennas are always used and only one single RSSI value is reported
     if wireless_driver == "iwlwifi":
         antenna_masks = [1]
 
     overall = True
-    for tx_power in tx_powers:
-        for phy_rate in phy_rates:
-            for antenna_mask in antenna_masks:
-                for channel in channels:
-                    # record any failure
-                    if not one_run(wireless_driver, tx_power, phy_rate, antenna_mask,
-                                   channel, *args, **kwds):
-                        overall = False
-                    # make sure images will get loaded only once
-                    kwds['load_images'] = False
+    journal = Journal(kwds.get('run_name', default_run_name))
+    post_processor = Pipeline() if pipeline else None
+    # the ssh connections are shared by all runs
+    with NodePool(default_gateway,
+                  kwds.get('slicename', default_slicename),
+                  verbose=kwds.get('verbose_ssh', False)) as pool:
+        for tx_power in tx_powers:
+            for phy_rate in phy_rates:
+                for antenna_mask in antenna_masks:
+                    for channel in channels:
+                        config = dict(tx_power=tx_power, phy_rate=phy_rate,
+                                      antenna_mask=antenna_mask,
+                                      channel=channel)
+                        if resume and journal.is_completed(config):
+                            print("skipping t{tx_power} r{phy_rate}"
+                                  " a{antenna_mask} ch{channel}"
+                                  " - already completed".format(**config))
+                            continue
+                        ok = one_run(wireless_driver, tx_power, phy_rate,
+                                     antenna_mask, channel, pool=pool,
+                                     pipeline=post_processor,
+                                     journal=journal,
+                                     *args, **kwds)
+                        # record any failure
+                        if not ok:
+                            overall = False
+                        # make sure images will get loaded only once
+                        if ok:
+                            kwds['load_images'] = False
+    if post_processor is not None:
+        print("waiting for post-processing")
+        with post_processor:
+            overall = post_processor.join() and overall
     return overall
 
 
@@ -410,6 +634,10 @@ def main():
                         help="""run in parallel, with this value as the
                         limit to the number of simultaneous pings - default is sequential;
                         -p 0 means no limit""")
+    parser.add_argument("-R", "--rounds", default=False, action='store_true',
+                        help="""run pings in rounds where each node is involved
+                        in one ping only, all pings in a round at the same time,
+                        up to the --parallel limit if provided""")
     # parser.add_argument("-T", "--ping-timeout", default=ping_timeout,
     #                    help="timeout for each individual ping")
     # parser.add_argument("-I", "--ping-interval", default=ping_interval,
@@ -419,6 +647,15 @@ def main():
     # parser.add_argument("-N", "--ping-number", default=ping_number,
     #                    help="specify number of ping packets to send")
 
+    parser.add_argument("--no-pipeline", dest='pipeline', default=True,
+                        action='store_false',
+                        help="""post-process each run before starting the next one,
+                        instead of in the background""")
+
+    parser.add_argument("--resume", default=False, action='store_true',
+                        help="""skip the settings that have already completed,
+                        as recorded in the journal of the output directory""")
+
     parser.add_argument("-n", "--dry-run", default=False, action='store_true',
                         help="do not run anything, just print out scheduler,"
                         " and generate .dot file")
@@ -438,7 +675,10 @@ def main():
                     verbose_ssh=args.verbose_ssh,
                     verbose_jobs=args.debug,
                     parallel=args.parallel,
+                    rounds=args.rounds,
                     dry_run=args.dry_run,
+                    pipeline=args.pipeline,
+                    resume=args.resume,
                     wireless_driver=args.wifi_driver
                     # ping_timeout = args.ping_timeout
                     # ping_interval = args.ping_interval
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+# pylint: disable=c0103, r0913
+
+"""
+Smooth coverage maps: the RSSI field received from one sender,
+interpolated from the values measured on the fit nodes onto
+a fine grid over the R2lab room
+
+Available methods are
+
+* 'idw': inverse distance weighting
+* 'rbf': thin-plate spline radial basis functions
+* 'kriging': ordinary kriging with an exponential variogram
+* 'pathloss': a log-distance path-loss model fitted on the sender
+
+Coordinates are the ones of R2labMap, i.e. in grid units,
+from (1, 1) to (9, 5); all the work boils down to small linear
+systems, one per sender, so this only needs numpy
+
+To precompute the maps of all senders in all runs of a run_name:
+
+    python3 coverage.py run_name [run_name ...]
+"""
+
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from processmap import NB_IDS, Aggregator
+from rssi import (
+    rssi_matrix, as_values, mtime, POSITIONS, GRID_WIDTH, GRID_HEIGHT)
+
+METHODS = ('idw', 'rbf', 'kriging', 'pathloss')
+DEFAULT_METHOD = 'idw'
+# grid points per grid unit
+DEFAULT_RESOLUTION = 10
+# inverse distance weighting
+IDW_POWER = 2
+# kriging: distance, in grid units, where correlation has mostly vanished
+KRIGING_RANGE = 4.
+# pathloss: the model is flattened closer than that
+MIN_DISTANCE = 0.5
+# the values that mean 'not heard' in RSSI.txt;
+# they are kept for interpolation, but not used to fit the path loss
+RSSI_FLOOR = Aggregator.RSSI_MIN
+
+
+def fine_grid(resolution=DEFAULT_RESOLUTION):
+    """
+    returns X, Y as 2 arrays [height, width] of the grid point
+    coordinates, with resolution points per grid unit
+    """
+    xs = np.linspace(1, GRID_WIDTH, (GRID_WIDTH - 1) * resolution + 1)
+    ys = np.linspace(1, GRID_HEIGHT, (GRID_HEIGHT - 1) * resolution + 1)
+    return np.meshgrid(xs, ys)
+
+
+def _distances(points, targets):
+    """
+    euclidian distances [targets, points]
+    """
+    delta = targets[:, None, :] - points[None, :, :]
+    return np.hypot(delta[..., 0], delta[..., 1])
+
+
+@lru_cache(maxsize=None)
+def _grid(resolution):
+    """
+    the fine grid points as an array [m, 2], and their
+    distances to all the node positions [m, NB_IDS]
+    """
+    X, Y = fine_grid(resolution)
+    targets = np.stack([X.ravel(), Y.ravel()], axis=1)
+    return targets, _distances(POSITIONS.astype(float), targets)
+
+
+# in the functions below, points [n, 2] are where values [n]
+# are known, and targets [m, 2] where they get interpolated;
+# distances [m, n] between both can be passed if already known
+
+def idw(points, values, targets, power=IDW_POWER, distances=None):
+    """
+    inverse distance weighting
+    """
+    if distances is None:
+        distances = _distances(points, targets)
+    exact = distances == 0
+    with np.errstate(divide='ignore'):
+        weights = distances ** -float(power)
+    # targets right on a point get its value
+    weights = np.where(exact.any(axis=1)[:, None], exact, weights)
+    return weights @ values / weights.sum(axis=1)
+
+
+def _thin_plate(distances):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(distances > 0,
+                        distances ** 2 * np.log(distances), 0.)
+
+
+def rbf(points, values, targets, smoothing=0., distances=None):
+    """
+    thin-plate spline interpolation, with a linear trend;
+    smoothing = 0 goes exactly through the points
+    """
+    if distances is None:
+        distances = _distances(points, targets)
+    n = len(points)
+    polynomial = np.hstack([np.ones((n, 1)), points])
+    system = np.zeros((n + 3, n + 3))
+    system[:n, :n] = (_thin_plate(_distances(points, points))
+                      + smoothing * np.eye(n))
+    system[:n, n:] = polynomial
+    system[n:, :n] = polynomial.T
+    rhs = np.concatenate([values, np.zeros(3)])
+    coefs = np.linalg.lstsq(system, rhs, rcond=None)[0]
+    return (_thin_plate(distances) @ coefs[:n]
+            + coefs[n] + targets @ coefs[n + 1:])
+
+
+def _variogram(distances, range_):
+    # the sill scales out of the kriging weights
+    return 1 - np.exp(-3 * distances / range_)
+
+
+def kriging(points, values, targets, range_=KRIGING_RANGE, distances=None):
+    """
+    ordinary kriging with an exponential variogram
+
+    the kriging system being symmetric, the weights for all targets
+    boil down to one solve against the values, in the dual form
+    """
+    if distances is None:
+        distances = _distances(points, targets)
+    n = len(points)
+    system = np.ones((n + 1, n + 1))
+    system[:n, :n] = _variogram(_distances(points, points), range_)
+    system[n, n] = 0
+    rhs = np.concatenate([values, [0.]])
+    coefs = np.linalg.lstsq(system, rhs, rcond=None)[0]
+    return _variogram(distances, range_) @ coefs[:n] + coefs[n]
+
+
+def fit_pathloss(sender, values):
+    """
+    fits rssi = p0 - 10 * exponent * log10(distance)
+    on the values received from sender, an array [NB_IDS];
+    distances are in grid units, so p0 is the RSSI at one grid unit
+
+    returns a tuple p0, exponent - (NaN, NaN) if not enough data
+    """
+    values = as_values(values)
+    known = ~np.isnan(values) & (values > RSSI_FLOOR) & (POSITIONS[:, 0] > 0)
+    known[sender] = False
+    distances = np.hypot(*(POSITIONS[known] - POSITIONS[sender]).T)
+    if known.sum() < 2:
+        return np.nan, np.nan
+    slope, p0 = np.polyfit(np.log10(distances), values[known], 1)
+    return p0, -slope / 10
+
+
+def pathloss(sender, values, targets):
+    """
+    the fitted path-loss model, evaluated on targets
+    """
+    p0, exponent = fit_pathloss(sender, values)
+    distances = np.hypot(*(targets - POSITIONS[sender]).T)
+    return p0 - 10 * exponent * np.log10(np.maximum(distances, MIN_DISTANCE))
+
+
+def interpolate(values, sender=None, method=DEFAULT_METHOD,
+                resolution=DEFAULT_RESOLUTION, **kwds):
+    """
+    the RSSI field from the values measured on the nodes,
+    either a dict node_id -> value as returned by read_rssi(),
+    or an array [NB_IDS] with NaN for missing nodes
+
+    the sender's own value, if any, is not taken into account
+
+    returns an array [height, width] over fine_grid(resolution),
+    all NaN if there is not enough data; extra keywords are
+    passed to the method, e.g. power for idw - pathloss takes none
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown interpolation method {method}")
+    if method == 'pathloss' and kwds:
+        raise ValueError(f"pathloss takes no extra parameter,"
+                         f" got {', '.join(kwds)}")
+    values = as_values(values)
+    targets, distances = _grid(resolution)
+    known = ~np.isnan(values) & (POSITIONS[:, 0] > 0)
+    if sender is not None:
+        known[sender] = False
+    if method == 'pathloss':
+        if sender is None:
+            raise ValueError("pathloss needs a sender")
+        field = pathloss(sender, values, targets)
+    elif not known.any():
+        field = np.full(len(targets), np.nan)
+    else:
+        function = dict(idw=idw, rbf=rbf, kriging=kriging)[method]
+        field = function(POSITIONS[known].astype(float), values[known],
+                         targets, distances=distances[:, known], **kwds)
+    return field.reshape(fine_grid(resolution)[0].shape)
+
+
+def coverage_name(rssi_rank, method=DEFAULT_METHOD,
+                  resolution=DEFAULT_RESOLUTION):
+    return f"COVERAGE-{method}-{rssi_rank}-{resolution}.npz"
+
+
+def precompute(run_root, rssi_rank, method=DEFAULT_METHOD,
+               resolution=DEFAULT_RESOLUTION):
+    """
+    computes the coverage maps of all senders in a run directory,
+    and stores them next to its RSSI.txt
+
+    returns an array [NB_IDS, height, width], all NaN for the
+    senders that are not in the run
+    """
+    run_root = Path(run_root)
+    matrix = rssi_matrix(run_root / "RSSI.txt")
+    X, _ = fine_grid(resolution)
+    maps = np.full((NB_IDS,) + X.shape, np.nan, dtype=np.float32)
+    if rssi_rank < matrix.shape[2]:
+        values = matrix[:, :, rssi_rank]
+        for sender in np.flatnonzero(~np.isnan(values).all(axis=1)).tolist():
+            maps[sender] = interpolate(values[sender], sender,
+                                       method=method, resolution=resolution)
+    np.savez(run_root / coverage_name(rssi_rank, method, resolution),
+             maps=maps, resolution=resolution)
+    return maps
+
+
+# (run_root, rssi_rank, method, resolution) -> (signature, maps)
+_coverages = {}
+
+def coverage(run_root, sender, rssi_rank, method=DEFAULT_METHOD,
+             resolution=DEFAULT_RESOLUTION):
+    """
+    the coverage map of sender, an array [height, width]
+    over fine_grid(resolution)
+
+    all the senders in a run are computed, and stored, at once
+    by precompute(); they are then kept in memory, as long
+    as RSSI.txt does not change
+    """
+    run_root = Path(run_root)
+    key = (run_root, rssi_rank, method, resolution)
+    text = run_root / "RSSI.txt"
+    stored = run_root / coverage_name(rssi_rank, method, resolution)
+    signature = (mtime(text), mtime(stored))
+    cached = _coverages.get(key)
+    if cached and cached[0] == signature:
+        return cached[1][sender]
+    text_mtime, stored_mtime = signature
+    maps = None
+    if stored_mtime is not None and (text_mtime or 0) <= stored_mtime:
+        try:
+            with np.load(stored) as npz:
+                maps = npz['maps']
+        except (OSError, KeyError, ValueError):
+            pass
+    if maps is None:
+        maps = precompute(run_root, rssi_rank, method, resolution)
+        signature = (text_mtime, mtime(stored))
+    _coverages[key] = (signature, maps)
+    return maps[sender]
+
+
+def precompute_all(run_name, methods=(DEFAULT_METHOD,),
+                   resolution=DEFAULT_RESOLUTION):
+    """
+    precompute the maps for all run directories in run_name,
+    for all the rssi_ranks available
+    """
+    for text in sorted(Path(run_name).glob("*/RSSI.txt")):
+        matrix = rssi_matrix(text)
+        ranks = np.flatnonzero(~np.isnan(matrix).all(axis=(0, 1)))
+        for method in methods:
+            for rssi_rank in ranks.tolist():
+                precompute(text.parent, rssi_rank, method, resolution)
+        print(f"{text.parent}: done")
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        precompute_all(arg)
@@ -0,0 +1,121 @@
+"""
+A JOURNAL.json file at the root of a run_name directory records
+the configurations of a sweep that have completed, together with
+the files they have produced and their checksums
+
+This way an interrupted sweep can be resumed without redoing the
+finished work; a configuration counts as completed only if all its
+files are still there and unchanged, otherwise it is run again
+"""
+
+# pylint: disable=c0103
+# this file is in both batman-vs-olsr/ and radiomap/, as each demo
+# directory is meant to be self-contained; keep the 2 copies in sync
+
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+JOURNAL = "JOURNAL.json"
+
+
+def checksum(path):
+    """
+    the sha256 of a file contents, as a hex string
+    """
+    digest = hashlib.sha256()
+    with Path(path).open('rb') as feed:
+        for chunk in iter(lambda: feed.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_file(path):
+    stat = path.stat()
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                sha256=checksum(path))
+
+
+def config_key(config):
+    """
+    config is a dictionary like dict(protocol='batman', interference='15')
+    """
+    return " ".join(f"{name}={value}" for name, value in config.items())
+
+
+class Journal:
+    """
+    the in-memory view of the JOURNAL.json file in run_name
+
+    it can be updated from several threads, e.g. from a pipeline
+    of post-processing jobs
+    """
+
+    def __init__(self, run_name):
+        self.path = Path(run_name) / JOURNAL
+        self.lock = threading.Lock()
+        try:
+            with self.path.open() as feed:
+                self.runs = json.load(feed)['runs']
+        except (OSError, ValueError, KeyError):
+            self.runs = {}
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write in a temporary file first, so that an interruption
+        # never leaves a partially written journal
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open('w') as feed:
+            json.dump(dict(runs=self.runs), feed, indent=2)
+        tmp.replace(self.path)
+
+    def record(self, config, run_root, patterns):
+        """
+        mark config as completed, with the files in run_root
+        that match the glob patterns
+        """
+        run_root = Path(run_root)
+        artifacts = {
+            str(path.relative_to(run_root)): describe_file(path)
+            for pattern in patterns
+            for path in sorted(run_root.glob(pattern))
+            if path.is_file()
+        }
+        with self.lock:
+            self.runs[config_key(config)] = dict(
+                config={name: str(value) for name, value in config.items()},
+                run_root=str(run_root),
+                completed=time.strftime("%Y-%m-%d %H:%M:%S"),
+                artifacts=artifacts,
+            )
+            self._write()
+
+    def forget(self, config):
+        with self.lock:
+            if self.runs.pop(config_key(config), None) is not None:
+                self._write()
+
+    def is_completed(self, config):
+        """
+        whether config has completed, and all its files are unchanged;
+        the checksum is computed only for the files that
+        have been touched since they were recorded
+        """
+        entry = self.runs.get(config_key(config))
+        if entry is None or not entry['artifacts']:
+            return False
+        run_root = Path(entry['run_root'])
+        for name, recorded in entry['artifacts'].items():
+            path = run_root / name
+            try:
+                stat = path.stat()
+            except OSError:
+                return False
+            if stat.st_size != recorded['size']:
+                return False
+            if (stat.st_mtime_ns != recorded['mtime_ns']
+                    and checksum(path) != recorded['sha256']):
+                return False
+        return True
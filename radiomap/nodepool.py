@@ -0,0 +1,129 @@
+"""
+the ssh connections to the gateway and to the nodes behind it,
+kept open across the runs of a sweep
+
+apssh connections belong to the asyncio event loop that has opened them,
+and Scheduler.run() creates a new loop each time; so the pool has
+its own loop, that all the runs go through, see NodePool.run()
+"""
+
+# pylint: disable=c0103
+# this file is in both batman-vs-olsr/ and radiomap/, as each demo
+# directory is meant to be self-contained; keep the 2 copies in sync
+
+import asyncio
+
+import asyncssh
+
+from apssh import SshNode, TimeHostFormatter
+
+
+class NodePool:
+    """
+    creates SshNode instances on demand, and keeps them for the next runs
+
+    before each run, the connections that are up get checked, and the
+    broken ones are dropped, so that apssh opens them again when needed
+
+    typical use
+
+        with NodePool(gateway, slicename) as pool:
+            for ...:
+                faraday = pool.gateway
+                node = pool.node("fit01")
+                ...
+                ok = pool.run(scheduler)
+    """
+
+    # how long we wait for the health check on one connection
+    check_timeout = 10
+
+    def __init__(self, gateway, slicename, verbose=False):
+        self.verbose = verbose
+        self.gateway = SshNode(
+            hostname=gateway, username=slicename,
+            formatter=TimeHostFormatter(), verbose=verbose)
+        # hostname -> SshNode
+        self.nodes = {}
+        self.runner = asyncio.Runner()
+
+    def node(self, hostname):
+        """
+        the SshNode for hostname, as root behind the gateway
+        """
+        if hostname not in self.nodes:
+            self.nodes[hostname] = SshNode(
+                gateway=self.gateway, hostname=hostname, username="root",
+                formatter=TimeHostFormatter(), verbose=self.verbose)
+        return self.nodes[hostname]
+
+    @staticmethod
+    async def _drop(node):
+        """
+        close a connection, ignoring errors as it is likely broken
+        """
+        try:
+            await node.close()
+        except Exception:                               # pylint: disable=w0703
+            pass
+        node.conn = None
+        node.sftp_client = None
+
+    async def _alive(self, node):
+        """
+        whether the connection to node, if any, still works
+        """
+        if not node.is_connected():
+            return True
+        try:
+            await asyncio.wait_for(node.conn.run("true", check=True),
+                                   timeout=self.check_timeout)
+            return True
+        except (asyncio.TimeoutError, OSError, asyncssh.Error):
+            return False
+
+    async def co_check(self):
+        """
+        drops the connections that do not work any longer
+
+        returns the list of the hostnames that were dropped
+        """
+        nodes = list(self.nodes.values())
+        if await self._alive(self.gateway):
+            alive = await asyncio.gather(*(self._alive(node) for node in nodes))
+            broken = [node for node, ok in zip(nodes, alive) if not ok]
+        else:
+            # the tunnels through the gateway are gone as well
+            broken = [node for node in nodes if node.is_connected()]
+            broken.append(self.gateway)
+        await asyncio.gather(*(self._drop(node) for node in broken))
+        for node in broken:
+            print(f"{node.hostname}: connection lost - will reconnect")
+        return [node.hostname for node in broken]
+
+    def run(self, scheduler):
+        """
+        same as scheduler.run(), but in the pool's event loop,
+        once the connections have been checked
+        """
+        self.runner.run(self.co_check())
+        return self.runner.run(scheduler.co_run())
+
+    async def co_close(self):
+        # the nodes first, as they go through the gateway
+        await asyncio.gather(*(self._drop(node)
+                               for node in self.nodes.values()))
+        await self._drop(self.gateway)
+
+    def close(self):
+        """
+        closes all the connections, the pool cannot be used afterwards
+        """
+        self.runner.run(self.co_close())
+        self.runner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
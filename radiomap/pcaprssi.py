@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+# pylint: disable=c0111, c0103, r0914
+# this file is in both batman-vs-olsr/ and radiomap/, as each demo
+# directory is meant to be self-contained; keep the 2 copies in sync
+
+"""
+A native reader for the pcap files captured with
+
+    tcpdump -i moni-xxx -y ieee802_11_radio -w fitxx.pcap
+
+that extracts, for all ICMP frames, the IP source and destination,
+and the dBm antenna signal(s) from the radiotap header; this is
+what we used to do with
+
+    tshark -2 -r fitxx.pcap -R "ip.dst==10.0.0.xx && icmp" \\
+       -Tfields -e ip.src -e ip.dst -e radiotap.dbm_antsignal
+
+The file is memory-mapped, and only the records boundaries are
+walked in python; the radiotap layout is decoded once for each
+distinct set of present flags, and all the rest is done with
+numpy on a view of the whole file
+
+One difference with tshark: only the outer IP header is considered;
+for ICMP errors - e.g. destination unreachable - tshark would also
+match ip.dst on the IP header quoted in the ICMP payload, and show
+both addresses in each field, like
+
+    10.0.0.14,10.0.0.1<TAB>10.0.0.1,10.0.0.22<TAB>-56,-56
+
+such frames are not the pings we measure; here they are kept only
+if their outer destination is the receiver, and shown with their
+outer addresses only
+
+Usage, same output as the tshark command above, but for ICMP errors:
+
+    python3 pcaprssi.py fitxx.pcap xx > result-xx.txt
+"""
+
+import sys
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# pcap magic numbers, as read in little endian
+MAGICS = {
+    0xa1b2c3d4: '<', 0xa1b23c4d: '<',
+    0xd4c3b2a1: '>', 0x4d3cb2a1: '>',
+}
+LINKTYPE_RADIOTAP = 127
+GLOBAL_HEADER = 24
+RECORD_HEADER = 16
+
+# radiotap fields in the radiotap namespace: bit -> (alignment, size)
+# we need to know all of them up to the last one present,
+# to locate the ones that come after
+RADIOTAP_FIELDS = {
+    0: (8, 8),      # TSFT
+    1: (1, 1),      # flags
+    2: (1, 1),      # rate
+    3: (2, 4),      # channel
+    4: (1, 2),      # FHSS
+    5: (1, 1),      # dBm antenna signal
+    6: (1, 1),      # dBm antenna noise
+    7: (2, 2),      # lock quality
+    8: (2, 2),      # TX attenuation
+    9: (2, 2),      # dB TX attenuation
+    10: (1, 1),     # dBm TX power
+    11: (1, 1),     # antenna
+    12: (1, 1),     # dB antenna signal
+    13: (1, 1),     # dB antenna noise
+    14: (2, 2),     # RX flags
+    15: (2, 2),     # TX flags
+    16: (1, 1),     # RTS retries
+    17: (1, 1),     # data retries
+    18: (4, 8),     # XChannel
+    19: (1, 3),     # MCS
+    20: (4, 8),     # A-MPDU status
+    21: (2, 12),    # VHT
+    22: (8, 12),    # timestamp
+    23: (2, 12),    # HE
+    24: (2, 12),    # HE-MU
+    25: (2, 6),     # HE-MU-other-user
+    26: (1, 1),     # 0-length-PSDU
+    27: (2, 4),     # L-SIG
+}
+DBM_ANTSIGNAL = 5
+RADIOTAP_NAMESPACE = 29
+VENDOR_NAMESPACE = 30
+EXT = 31
+
+# how many antenna signals we keep per frame,
+# i.e. the global one plus 3 antennas
+MAX_ANTSIGNALS = 4
+# in the antsignals arrays for missing values
+NO_SIGNAL = -128
+
+# 802.11 data frames carry IPv4 in LLC/SNAP
+LLC_SNAP_IPV4 = np.array([0xaa, 0xaa, 0x03, 0, 0, 0, 0x08, 0x00],
+                         dtype=np.uint8)
+ICMP = 1
+
+
+def antsignal_offsets(present_words):
+    """
+    the offsets in the radiotap header of all the dBm antenna signal
+    fields, given the list of 32-bit present words
+
+    decoding stops at the first unknown field, as we can't
+    know where the next ones are
+    """
+    offset = 4 + 4 * len(present_words)
+    offsets = []
+    radiotap = True
+    for word in present_words:
+        if radiotap:
+            for bit in range(RADIOTAP_NAMESPACE):
+                if not word & (1 << bit):
+                    continue
+                if bit not in RADIOTAP_FIELDS:
+                    return offsets
+                align, size = RADIOTAP_FIELDS[bit]
+                offset += -offset % align
+                if bit == DBM_ANTSIGNAL:
+                    offsets.append(offset)
+                offset += size
+        elif word & ~(1 << RADIOTAP_NAMESPACE | 1 << VENDOR_NAMESPACE
+                      | 1 << EXT):
+            # we would need the vendor namespace skip_length
+            # that comes with the data; not worth it
+            return offsets
+        radiotap = not word & (1 << VENDOR_NAMESPACE)
+    return offsets
+
+
+def _records(buffer, endian):
+    """
+    walk the records, returns 2 arrays with the offsets
+    of the packet data, and their captured lengths
+    """
+    header = struct.Struct(endian + "IIII")
+    size = len(buffer)
+    starts, lengths = [], []
+    position = GLOBAL_HEADER
+    while position + RECORD_HEADER <= size:
+        _, _, incl_len, _ = header.unpack_from(buffer, position)
+        position += RECORD_HEADER
+        if position + incl_len > size:
+            # truncated capture
+            break
+        starts.append(position)
+        lengths.append(incl_len)
+        position += incl_len
+    return (np.array(starts, dtype=np.int64),
+            np.array(lengths, dtype=np.int64))
+
+
+def _gather(view, indices, limits):
+    """
+    view[indices] where indices are below limits, 0 otherwise
+    """
+    valid = indices < limits
+    return np.where(valid, view[np.where(valid, indices, 0)], 0), valid
+
+
+def read_pcap_rssi(filename):
+    """
+    scans a radiotap pcap file and returns a dictionary of arrays,
+    one row per ICMP over IPv4 frame that has at least
+    one dBm antenna signal
+
+    * src, dst: uint32 IPv4 addresses
+    * antsignals: int8 [frames, MAX_ANTSIGNALS] padded with NO_SIGNAL
+    * nb_antsignals: the number of valid antsignals in each row
+    """
+    path = Path(filename)
+    empty = dict(src=np.zeros(0, dtype=np.uint32),
+                 dst=np.zeros(0, dtype=np.uint32),
+                 antsignals=np.zeros((0, MAX_ANTSIGNALS), dtype=np.int8),
+                 nb_antsignals=np.zeros(0, dtype=np.int8))
+    if path.stat().st_size < GLOBAL_HEADER:
+        return empty
+    with path.open('rb') as feed, \
+            mmap.mmap(feed.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        magic, = struct.unpack_from("<I", buffer, 0)
+        if magic not in MAGICS:
+            raise ValueError(f"{filename}: not a pcap file")
+        endian = MAGICS[magic]
+        linktype, = struct.unpack_from(endian + "I", buffer, 20)
+        if linktype != LINKTYPE_RADIOTAP:
+            raise ValueError(f"{filename}: unexpected link type {linktype}")
+        starts, lengths = _records(buffer, endian)
+        view = np.frombuffer(buffer, dtype=np.uint8)
+        try:
+            return _decode(view, starts, lengths) if len(starts) else empty
+        finally:
+            # the mmap can't be closed while a view is exported
+            del view
+
+
+def _decode(view, starts, lengths):
+    ends = starts + lengths
+
+    def u8(offsets):
+        return _gather(view, offsets, ends)
+
+    def le16(offsets):
+        low, valid = u8(offsets)
+        high, _ = u8(offsets + 1)
+        return low.astype(np.int64) | high.astype(np.int64) << 8, valid
+
+    def le32(offsets):
+        low, valid = le16(offsets)
+        high, _ = le16(offsets + 2)
+        return low | high << 16, valid & (offsets + 3 < ends)
+
+    # radiotap: the present words, the first one is at offset 4
+    radiotap_len, ok = le16(starts + 2)
+    words = []
+    more = ok.copy()
+    while not words or more.any():
+        word, valid = le32(starts + 4 + 4 * len(words))
+        word = np.where(more & valid, word, 0)
+        words.append(word)
+        more &= valid & (word >> EXT & 1 == 1)
+    # decode each distinct layout only once; np.unique on rows
+    # is slow, so we go for a 64-bit hash of the words first
+    words = np.stack(words, axis=1).astype(np.uint64)
+    hashes = np.zeros(len(words), dtype=np.uint64)
+    for column in words.T:
+        hashes = hashes * np.uint64(0x100000001b3) ^ column
+    _, firsts, inverse = np.unique(hashes, return_index=True,
+                                   return_inverse=True)
+    layouts = words[firsts]
+    if not (layouts[inverse] == words).all():
+        # collision
+        layouts, inverse = np.unique(words, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    offsets = np.full((len(layouts), MAX_ANTSIGNALS), -1, dtype=np.int64)
+    for index, layout in enumerate(layouts.tolist()):
+        # trailing zeros are just padding
+        nb_words = 1
+        while nb_words < len(layout) and layout[nb_words - 1] >> EXT & 1:
+            nb_words += 1
+        found = antsignal_offsets(layout[:nb_words])[:MAX_ANTSIGNALS]
+        offsets[index, :len(found)] = found
+    offsets = offsets[inverse]
+
+    # 802.11 header
+    frame = starts + radiotap_len
+    control, valid = u8(frame)
+    flags, _ = u8(frame + 1)
+    ok &= valid & (control >> 2 & 3 == 2) & (flags & 0x40 == 0)
+    qos = (control >> 4 & 8) != 0
+    header_len = (24 + 6 * ((flags & 3) == 3) + 2 * qos
+                  + 4 * (qos & (flags & 0x80 != 0)))
+    llc = frame + header_len
+    for index, expected in enumerate(LLC_SNAP_IPV4):
+        byte, valid = u8(llc + index)
+        ok &= valid & (byte == expected)
+    # IPv4 header
+    ip = llc + len(LLC_SNAP_IPV4)
+    version, valid = u8(ip)
+    protocol, _ = u8(ip + 9)
+    ok &= valid & (version >> 4 == 4) & (protocol == ICMP) & (ip + 20 <= ends)
+    src = np.zeros(len(starts), dtype=np.uint32)
+    dst = np.zeros(len(starts), dtype=np.uint32)
+    for index in range(4):
+        src = src << 8 | u8(ip + 12 + index)[0].astype(np.uint32)
+        dst = dst << 8 | u8(ip + 16 + index)[0].astype(np.uint32)
+
+    # antenna signals
+    present = (offsets >= 0) & (starts[:, None] + offsets < frame[:, None])
+    signals = view[np.where(present, starts[:, None] + offsets, 0)]
+    antsignals = np.where(present, signals.view(np.int8), NO_SIGNAL)
+    nb_antsignals = present.sum(axis=1)
+    ok &= nb_antsignals > 0
+    return dict(src=src[ok], dst=dst[ok],
+                antsignals=antsignals[ok].astype(np.int8),
+                nb_antsignals=nb_antsignals[ok].astype(np.int8))
+
+
+def ip_address(address):
+    return ".".join(str(address >> shift & 0xff) for shift in (24, 16, 8, 0))
+
+
+def pcap_rssi(filename, receiver_id=None):
+    """
+    same as read_pcap_rssi(), restricted to the frames
+    sent to 10.0.0.<receiver_id> if provided
+    """
+    frames = read_pcap_rssi(filename)
+    if receiver_id is None:
+        return frames
+    keep = frames['dst'] == (10 << 24 | int(receiver_id))
+    return {key: array[keep] for key, array in frames.items()}
+
+
+def write_result(filename, result_name, receiver_id, output=None):
+    """
+    writes a result-xx.txt file from a fitxx.pcap,
+    in the format that tshark -Tfields would produce
+
+    if output is provided, it is an open file object that
+    gets written instead, and result_name is ignored
+    """
+    if output is None:
+        with Path(result_name).open('w') as result:
+            return write_result(filename, result_name, receiver_id, result)
+    frames = pcap_rssi(filename, receiver_id)
+    names = {}
+    for src, dst, antsignals, nb_antsignals in zip(
+            frames['src'].tolist(), frames['dst'].tolist(),
+            frames['antsignals'].tolist(),
+            frames['nb_antsignals'].tolist()):
+        for address in (src, dst):
+            if address not in names:
+                names[address] = ip_address(address)
+        signals = ",".join(str(signal)
+                           for signal in antsignals[:nb_antsignals])
+        output.write(f"{names[src]}\t{names[dst]}\t{signals}\n")
+    return len(frames['src'])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} fitxx.pcap xx")
+        exit(1)
+    write_result(sys.argv[1], None, sys.argv[2], output=sys.stdout)
@@ -2,45 +2,75 @@
 helper tools for aggregating (averaging) multiple rssi reports
 """
 
-class Averager:
-    """
-    For each couple (receiver, sender) we gather
-    a number of measurement points that must be averaged
+import io
+import os
 
-    this is done through an instance of this Averager class
-    all measurement points will contain one, two or three values
-    depending on the number of antennas
+import numpy as np
 
-    each measurement point is recorded, and at the end
-    averages returns the right value(s)
-    """
+from pcaprssi import pcap_rssi, NO_SIGNAL
 
-    def __init__(self, columns):
-        """
-        number of expected columns
-        """
-        self.number = 0
-        self.columns = columns
-#        print("number of columns: {}".format(columns))
-        self.total = [0 for i in range(self.columns)]
+# node ids are 1..37, so 38 makes for simple indexing
+NB_IDS = 38
+# RSSI.txt in binary form: float32 [NB_IDS, NB_IDS, RSSI_COLUMNS]
+RSSI_NPY = "RSSI.npy"
+# the global value, and then one per antenna
+RSSI_COLUMNS = 4
 
-    def record_point(self, values):
-        """
-        values should have as many measurements as columns
-        """
-        self.number += 1
-        for i in range(self.columns):
-            self.total[i] += values[i]
 
-    def averages(self, default):
-        """
-        once all measurement points have been recorded,
-        they can be averaged
-        """
-        if self.number == 0:
-            return [default for i in range(self.columns)]
-        else:
-            return [self.total[i] / self.number for i in range(self.columns)]
+def parse_result(text, columns):
+    """
+    parse the contents of a result-N.txt file, with lines like
+        10.0.0.1<TAB>10.0.0.12<TAB>-63,-62
+    and returns 3 arrays senders, receivers and rssis [lines, columns]
+
+    lines with less than columns RSSI values are ignored,
+    extra values are ignored as well
+    """
+    if text and not text.endswith("\n"):
+        text += "\n"
+    # the fast way, if all lines are made of 2 addresses and
+    # the same number of RSSIs; this rules out the ICMP errors,
+    # where tshark shows 2 comma-separated addresses in each field
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    ends = np.flatnonzero(data == ord("\n"))
+    tabs = np.cumsum(data == ord("\t"))
+    commas = np.flatnonzero(data == ord(","))
+    tabs_per_line = np.diff(tabs[ends], prepend=0)
+    commas_per_line = np.bincount(np.searchsorted(ends, commas),
+                                  minlength=len(ends))
+    # the number of tabs before each comma, on its own line
+    line_tabs = np.concatenate(([0], tabs[ends]))
+    tabs_before = (tabs[commas]
+                   - line_tabs[np.searchsorted(ends, commas)])
+    width = 2 + commas_per_line[0] + 1 if len(ends) else 0
+    if (width >= 2 + columns and (tabs_per_line == 2).all()
+            and (commas_per_line == width - 3).all()
+            and (tabs_before == 2).all()):
+        try:
+            tokens = np.loadtxt(
+                io.StringIO(text.replace("10.0.0.", "").replace(",", "\t")),
+                dtype=np.int64, delimiter="\t", ndmin=2)
+        except ValueError:
+            tokens = None
+        if tokens is not None and tokens.shape == (len(ends), width):
+            return (tokens[:, 0], tokens[:, 1],
+                    tokens[:, 2:2 + columns])
+    # otherwise, line by line
+    senders, receivers, rssis = [], [], []
+    for line in text.split("\n"):
+        try:
+            sender_ip, receiver_ip, comma_rssis = line.split()
+            values = [int(x) for x in comma_rssis.split(',')]
+        except ValueError:
+            continue
+        if len(values) < columns:
+            continue
+        senders.append(int(sender_ip.split('.')[-1]))
+        receivers.append(int(receiver_ip.split('.')[-1]))
+        rssis.append(values[:columns])
+    return (np.array(senders, dtype=np.int64),
+            np.array(receivers, dtype=np.int64),
+            np.array(rssis, dtype=np.int64).reshape(-1, columns))
 
 
 class Aggregator:
@@ -48,10 +78,16 @@ class Aggregator:
     """
     one instance of this class for each call to one_run
     will do the aggregation into RSSI.txt
+
+    all measurement points will contain one, two, three or four values
+    depending on the number of antennas; they are accumulated
+    in arrays indexed by (sender, receiver, column), and besides the
+    averages that go in RSSI.txt, we also compute the number of points,
+    variance and median, that go in RSSI-STATS.npz
     """
 
     # we could also count the ones in a binary form
-    # for Intel 5300 cards only one column of RSSI for all 3 antennas 
+    # for Intel 5300 cards only one column of RSSI for all 3 antennas
     mask_to_number = {1: 1, 3: 2, 7: 3, }
 
     RSSI_MAX = 0
@@ -68,40 +104,145 @@ class Aggregator:
             self.nb_antennas = self.mask_to_number[antenna_mask]
         else:
             self.nb_antennas = 0
-        # internal result is a dicted hashed on
-        # a sender, receiver tuple
-        # value is a counter how_many, total
-        self.RSSI = {
-            (sender, receiver): Averager(self.nb_antennas + 1)
-            for sender in node_ids for receiver in node_ids
-        }
+        self.columns = self.nb_antennas + 1
+        # the measurement points, one chunk per result file
+        self.pairs = []
+        self.values = []
+
+    def record_points(self, senders, receivers, rssis):
+        """
+        record measurement points, given as arrays of
+        sender ids, receiver ids, and rssis [points, columns]
+        """
+        known = np.zeros(NB_IDS, dtype=bool)
+        known[self.node_ids] = True
+        keep = ((senders >= 0) & (senders < NB_IDS)
+                & (receivers >= 0) & (receivers < NB_IDS))
+        keep[keep] = known[senders[keep]] & known[receivers[keep]]
+        self.pairs.append(senders[keep] * NB_IDS + receivers[keep])
+        self.values.append(rssis[keep])
+
+    def load(self, node_id):
+        """
+        record the points from result-N.txt, or from fitN.pcap
+        if the former is missing
+        """
+        result_name = self.run_root / "result-{}.txt".format(node_id)
+        if result_name.exists():
+            self.record_points(
+                *parse_result(result_name.read_text(), self.columns))
+            return
+        frames = pcap_rssi(self.run_root / "fit{}.pcap".format(node_id),
+                           node_id)
+        rssis = frames['antsignals'][:, :self.columns].astype(np.int64)
+        keep = (rssis != NO_SIGNAL).all(axis=1)
+        self.record_points(
+            (frames['src'][keep] & 0xff).astype(np.int64),
+            (frames['dst'][keep] & 0xff).astype(np.int64), rssis[keep])
+
+    def _points(self):
+        pairs = np.concatenate(self.pairs or [np.zeros(0, dtype=np.int64)])
+        values = np.concatenate(
+            self.values or [np.zeros((0, self.columns), dtype=np.int64)])
+        return pairs, values
+
+    def averages(self):
+        """
+        returns count [NB_IDS * NB_IDS] the number of points,
+        and mean [NB_IDS * NB_IDS, columns], NaN where there is no point
+        """
+        pairs, values = self._points()
+        return self._averages(pairs, values)
+
+    def _averages(self, pairs, values):
+        size = NB_IDS * NB_IDS
+        count = np.bincount(pairs, minlength=size)
+        total = np.stack([np.bincount(pairs, weights=column, minlength=size)
+                          for column in values.T.astype(float)], axis=1)
+        with np.errstate(invalid='ignore'):
+            return count, total.reshape(size, self.columns) / count[:, None]
+
+    def statistics(self):
+        """
+        returns a dictionary with
+        * count: int32 [NB_IDS, NB_IDS] the number of points
+        * mean, variance, median: float32 [NB_IDS, NB_IDS, columns]
+          NaN where there is no point
+        """
+        pairs, values = self._points()
+        count, mean = self._averages(pairs, values)
+        _, squares = self._averages(pairs, values.astype(float) ** 2)
+        variance = np.maximum(squares - mean ** 2, 0)
+        # medians: sort points by pair, and then by value,
+        # which is done in one go by sorting on a combined key
+        median = np.full(mean.shape, np.nan)
+        starts = np.cumsum(count) - count
+        present = count > 0
+        low = starts[present] + (count[present] - 1) // 2
+        high = starts[present] + count[present] // 2
+        if len(values):
+            lowest = values.min()
+            span = values.max() - lowest + 1
+            for column in range(self.columns):
+                ranked = np.sort(pairs * span + (values[:, column] - lowest))
+                ranked = ranked % span + lowest
+                median[present, column] = (ranked[low] + ranked[high]) / 2
+        shape = (NB_IDS, NB_IDS, self.columns)
+        return dict(
+            count=count.reshape(NB_IDS, NB_IDS).astype(np.int32),
+            mean=mean.reshape(shape).astype(np.float32),
+            variance=variance.reshape(shape).astype(np.float32),
+            median=median.reshape(shape).astype(np.float32),
+        )
+
+    def matrix(self):
+        """
+        the values that go in RSSI.txt, as a float32 array
+        [NB_IDS, NB_IDS, RSSI_COLUMNS] indexed by sender and receiver ids,
+        NaN for the nodes and columns that are not involved
+        """
+        count, mean = self.averages()
+        count = count.reshape(NB_IDS, NB_IDS)
+        mean = mean.reshape(NB_IDS, NB_IDS, self.columns)
+        ids = np.array(self.node_ids)
+        block = mean[np.ix_(ids, ids)]
+        # default values where we have no point
+        defaults = np.where(np.eye(len(ids), dtype=bool),
+                            self.RSSI_MAX, self.RSSI_MIN)
+        missing = count[np.ix_(ids, ids)] == 0
+        block[missing] = defaults[missing][:, None]
+        matrix = np.full((NB_IDS, NB_IDS, RSSI_COLUMNS), np.nan)
+        matrix[np.ix_(ids, ids, np.arange(self.columns))] = block
+        return matrix
 
     def run(self):
         """
         call at the end of one_run
         """
-        for sender in self.node_ids:
-            result_name = self.run_root / "result-{}.txt".format(sender)
-            with result_name.open() as result_file:
-                for line in result_file:
-                    sender_ip, receiver_ip, comma_rssis = line.split()
-                    sender_id = int(sender_ip.split('.')[-1])
-                    receiver_id = int(receiver_ip.split('.')[-1])
-                    if ',' in comma_rssis:
-                        rssis = [int(x) for x in comma_rssis.split(',')]
-                    else:
-                        rssis = [int(comma_rssis)]
-
-                    averager = self.RSSI[sender_id, receiver_id]
-                    averager.record_point(rssis)
+        for node_id in self.node_ids:
+            self.load(node_id)
+        matrix = self.matrix()
 
         # consolidated file is called RSSI.txt
         aggragate_name = self.run_root / "RSSI.txt"
         with aggragate_name.open("w") as aggregate_file:
-            for (sender, receiver), averager in self.RSSI.items():
-                default = self.RSSI_MAX if sender == receiver else self.RSSI_MIN
-                avgs = averager.averages(default=default)
-                line = "10.0.0.{:02d}\t10.0.0.{:02d}\t".format(
-                    sender, receiver)
-                line += "\t".join("{0:.2f}".format(v) for v in avgs)
-                aggregate_file.write(line + "\n")
+            for sender in self.node_ids:
+                for receiver in self.node_ids:
+                    avgs = matrix[sender, receiver, :self.columns].tolist()
+                    texts = ["{0:.2f}".format(v) for v in avgs]
+                    line = "10.0.0.{:02d}\t10.0.0.{:02d}\t".format(
+                        sender, receiver)
+                    line += "\t".join(texts)
+                    aggregate_file.write(line + "\n")
+                    # so that both files have the exact same contents
+                    matrix[sender, receiver, :self.columns] = [
+                        float(text) for text in texts]
+        # same contents in binary form, see rssi.py; readers may have
+        # it memory-mapped, so it is replaced rather than rewritten
+        binary = self.run_root / RSSI_NPY
+        with binary.with_suffix(".tmp").open('wb') as feed:
+            np.save(feed, matrix.astype(np.float32))
+        os.replace(binary.with_suffix(".tmp"), binary)
+        np.savez(self.run_root / "RSSI-STATS.npz",
+                 node_ids=np.array(self.node_ids, dtype=np.int16),
+                 **self.statistics())
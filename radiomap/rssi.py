@@ -3,88 +3,200 @@ helper to read a RSSI.txt file
 maybe should belong in processmap.py
 """
 
+from pathlib import Path
+
 import numpy as np
 
 from r2lab import R2labMap
 
+from processmap import NB_IDS, RSSI_COLUMNS, RSSI_NPY
+
+
+def read_rssi_text(filename):
+    """
+    parse a RSSI.txt file into a float32 array
+    [NB_IDS, NB_IDS, RSSI_COLUMNS] like the one in RSSI.npy
+    """
+    matrix = np.full((NB_IDS, NB_IDS, RSSI_COLUMNS), np.nan,
+                     dtype=np.float32)
+    with open(filename) as in_file:
+        for line in in_file:
+            try:
+                ip_snd, ip_rcv, *values = line.split()
+                *_, n_snd = ip_snd.split('.')
+                *_, n_rcv = ip_rcv.split('.')
+                values = [float(value) for value in values][:RSSI_COLUMNS]
+                matrix[int(n_snd), int(n_rcv), :len(values)] = values
+            except (ValueError, IndexError):
+                pass
+    return matrix
+
+
+def mtime(path):
+    """
+    the modification time of path in ns, None if it does not exist
+    """
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+# RSSI.txt path -> (signature, matrix)
+_matrices = {}
+
+def rssi_matrix(filename):
+    """
+    the contents of a RSSI.txt file as a float32 array
+    [NB_IDS, NB_IDS, RSSI_COLUMNS] indexed by sender and receiver ids,
+    with NaN for the nodes and values that are not available
+
+    this is read from the RSSI.npy file next to RSSI.txt, that is
+    memory-mapped; for older runs that only have RSSI.txt, or when
+    RSSI.npy is outdated, RSSI.txt gets parsed in memory instead;
+    either way the result is kept until one of these files changes
+
+    this never writes in the run directory, RSSI.npy is created
+    when post-processing, see processmap.py
+    """
+    text = Path(filename)
+    binary = text.with_name(RSSI_NPY)
+    signature = (mtime(text), mtime(binary))
+    cached = _matrices.get(text)
+    if cached and cached[0] == signature:
+        return cached[1]
+    text_mtime, binary_mtime = signature
+    if binary_mtime is not None and (text_mtime or 0) <= binary_mtime:
+        matrix = np.load(binary, mmap_mode='r')
+    else:
+        matrix = read_rssi_text(text)
+    _matrices[text] = (signature, matrix)
+    return matrix
+
+
+def read_rssi_row(filename, sender):
+    """
+    the RSSIs received from sender, as a float32 array
+    [NB_IDS, RSSI_COLUMNS] indexed by receiver id
+    """
+    return rssi_matrix(filename)[sender]
+
+
 def read_rssi(filename, sender, rssi_rank):
     '''
     read a RSSI file and, given a sender node and
     an rssi_rank, returns a dictionary
     receiver_node_number -> value
     '''
-
-    node_number_to_value = {}
+    if not 0 <= sender < NB_IDS:
+        print("sender {} not present in {}"
+              .format(sender, filename))
+        return {}
     try:
-        with open(filename) as in_file:
-            for line in in_file:
-                try:
-                    ip_snd, ip_rcv, *values = line.split()
-                    *_, n_snd = ip_snd.split('.')
-                    *_, n_rcv = ip_rcv.split('.')
-                    n_snd = int(n_snd)
-                    n_rcv = int(n_rcv)
-                    if n_snd != sender:
-                        continue
-                    node_number_to_value[n_rcv] = values[rssi_rank]
-                except IndexError as e:
-                    print("rssi_rank {} not present in values"
-                          .format(rssi_rank))
+        row = read_rssi_row(filename, sender)
     except IOError as e:
         print("Cannot open file {}: {}" .format(filename, e))
-
-    return node_number_to_value
+        return {}
+    # the columns that RSSI.txt actually has for that sender
+    present = np.flatnonzero(~np.isnan(row).all(axis=0))
+    if not 0 <= rssi_rank < RSSI_COLUMNS or (
+            len(present) and rssi_rank > present.max()):
+        print("rssi_rank {} not present in values"
+              .format(rssi_rank))
+        return {}
+    values = row[:, rssi_rank]
+    receivers = np.flatnonzero(~np.isnan(values))
+    # values have 2 decimals in RSSI.txt
+    return dict(zip(receivers.tolist(),
+                    np.round(values[receivers].astype(float), 2).tolist()))
 
 # convert to plotting
 
+# computed once: POSITIONS[node_id] is (x, y) in the R2labMap
+# coordinates, that start at 1; row 0 is (0, 0) and unused
+_r2labmap = R2labMap()
+POSITIONS = np.zeros((NB_IDS, 2), dtype=np.int8)
+for _node_id, _position in _r2labmap.node_to_position.items():
+    POSITIONS[_node_id] = _position
+NODE_IDS = np.flatnonzero(POSITIONS[:, 0])
+GRID_WIDTH, GRID_HEIGHT = POSITIONS.max(axis=0).tolist()
+# the grid cells with no node - pillars and the like
+HOLES = np.ones((GRID_HEIGHT, GRID_WIDTH), dtype=bool)
+HOLES[POSITIONS[NODE_IDS, 1] - 1, POSITIONS[NODE_IDS, 0] - 1] = False
+# the value shown in the holes
+HOLE_VALUE = -100
+
+
+def as_values(rssi):
+    """
+    rssi is either a dict node_id -> value as returned by read_rssi(),
+    a list of such dicts, or an array [..., NB_IDS] indexed by node id
+    with NaN for the missing nodes, e.g. for several senders at once
+
+        rssi_matrix(filename)[senders, :, rssi_rank]
+
+    returns a float array [NB_IDS] or [senders, NB_IDS]
+    """
+    if isinstance(rssi, dict):
+        values = np.full(NB_IDS, np.nan)
+        if rssi:
+            values[list(rssi.keys())] = list(rssi.values())
+        return values
+    if isinstance(rssi, list):
+        return np.stack([as_values(one) for one in rssi])
+    return np.asarray(rssi, dtype=float)
+
+
 #################### for plotly
-def rssi_to_heatmap(rssi_dict):
+def rssi_to_heatmap(rssi):
     """
     converts an input dict into suitable values
     for plotting in plotly
 
     Parameters:
-        rssi_dict is expected to be a dict: node_id -> value
+        rssi is expected to be a dict: node_id -> value,
+        or a batch of senders, see as_values()
 
     Returns:
-        a tuple X, Y, Z, T(ext) of arrays for plotly
+        a tuple X, Y, Z, T(ext) of arrays for plotly, for all the nodes
+        that have a value; with a batch, Z is [senders, nodes],
+        with NaN for the nodes that some senders do not reach
     """
-    # input dict may have holes
-    r2labmap = R2labMap()
-    X, Y, Z, T = [], [], [], []
-    for node_id, value in rssi_dict.items():
-        x, y = r2labmap.position(node_id)
-        X.append(x)
-        Y.append(y)
-        Z.append(value)
-        T.append("fit{:02d}".format(node_id))
-    return X, Y, Z, T
+    values = as_values(rssi)
+    present = ~np.isnan(values)
+    # input may have holes
+    node_ids = np.flatnonzero(present.reshape(-1, NB_IDS).any(axis=0))
+    X, Y = POSITIONS[node_ids].T.astype(int)
+    T = ["fit{:02d}".format(node_id) for node_id in node_ids.tolist()]
+    return X, Y, values[..., node_ids], T
 
 
-def rssi_to_3d(rssi_dict):
+def rssi_to_3d(rssi):
     """
     converts an input dict into suitable values for plotting
     in 3D - either for plotly's Surface (needs T)
     or ipyvolume (does not)
 
     Parameters:
-        rssi_dict is expected to be a dict: node_id -> value
+        rssi is expected to be a dict: node_id -> value,
+        or a batch of senders, see as_values()
 
     Returns:
-        will return a triple X, Y, Z of numpy arrays for ipyvolume
+        will return a triple X, Y, Z of numpy arrays for ipyvolume,
+        and T for plotly; with a batch, Z is [senders, height, width]
     """
-    r2labmap = R2labMap()
+    values = as_values(rssi)
     # Make X,Y R2lab grid of nodes
-    X = np.arange(1, 10, 1, dtype=np.integer)
-    Y = np.arange(1, 6, 1, dtype=np.integer)
-    X, Y = np.meshgrid(X, Y)
-
-    Z = np.zeros((5, 9), dtype=float)
-    Z[0, 3] = Z[0, 4] = Z[0, 5] = -100 # np.nan
-    Z[3, 3] = Z[3, 5] = Z[2, 8] = Z[3, 8] = Z[4, 8] = -100 # np.nan
-    T = [ ["None"]*9 for i in range(6) ]
-    for node_id, value in rssi_dict.items():
-        x, y = r2labmap.position(node_id)
-        Z[y-1, x-1] = value
-        T[y-1][x-1]="fit{:02d}".format(node_id)
+    X, Y = np.meshgrid(np.arange(1, GRID_WIDTH + 1),
+                       np.arange(1, GRID_HEIGHT + 1))
+    Z = np.zeros(values.shape[:-1] + HOLES.shape, dtype=float)
+    Z[..., HOLES] = HOLE_VALUE
+    xs, ys = POSITIONS[NODE_IDS].T.astype(int)
+    node_values = values[..., NODE_IDS]
+    Z[..., ys - 1, xs - 1] = np.where(np.isnan(node_values), 0, node_values)
+    T = [["None"] * GRID_WIDTH for _ in range(GRID_HEIGHT)]
+    present = ~np.isnan(node_values.reshape(-1, len(NODE_IDS))).all(axis=0)
+    for node_id, x, y in zip(NODE_IDS[present].tolist(),
+                             xs[present].tolist(), ys[present].tolist()):
+        T[y - 1][x - 1] = "fit{:02d}".format(node_id)
     return X, Y, Z, T
@@ -0,0 +1,160 @@
+"""
+all the RSSI.txt files in a run_name, as one multi-dimensional array
+indexed by (tx_power, phy_rate, antenna_mask, channel,
+sender, receiver, rssi_rank)
+
+e.g. to compare tx powers for sender 1 on the first antenna
+
+    cube = RSSICube("datasample2")
+    axes, values = cube.select(sender=1, phy_rate=1, antenna_mask=7,
+                               channel=1, rssi_rank=1)
+    # axes is ['tx_power', 'receiver']
+    # and values is an array [len(cube.axes['tx_power']), 38]
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+
+from processmap import NB_IDS, RSSI_COLUMNS
+from rssi import rssi_matrix
+
+# the parameters of a run, see acquiremap.naming_scheme
+RUN_AXES = ('tx_power', 'phy_rate', 'antenna_mask', 'channel')
+# and the dimensions of one RSSI matrix
+MATRIX_AXES = ('sender', 'receiver', 'rssi_rank')
+AXES = RUN_AXES + MATRIX_AXES
+
+# the consolidated file, at the root of run_name
+CUBE = "RSSI-CUBE.npz"
+
+run_pattern = re.compile(
+    r'^t(?P<tx_power>\d+)-r(?P<phy_rate>\d+)'
+    r'-a(?P<antenna_mask>\d+)-ch(?P<channel>\d+)$')
+
+
+def scan_runs(run_name):
+    """
+    returns a dictionary (tx_power, phy_rate, antenna_mask, channel)
+    -> path of RSSI.txt, for all the run directories in run_name
+    """
+    runs = {}
+    for run_root in sorted(Path(run_name).iterdir()):
+        match = run_pattern.match(run_root.name)
+        if match and (run_root / "RSSI.txt").exists():
+            settings = tuple(int(match.group(axis)) for axis in RUN_AXES)
+            runs[settings] = run_root / "RSSI.txt"
+    return runs
+
+
+class RSSICube:
+    """
+    the run directories are scanned once at creation time;
+    each run gets loaded only when needed, see select(),
+    or all at once with load(), that uses a consolidated file
+    """
+
+    def __init__(self, run_name):
+        self.run_name = Path(run_name)
+        self.runs = scan_runs(run_name)
+        self.axes = {
+            axis: sorted({settings[i] for settings in self.runs})
+            for i, axis in enumerate(RUN_AXES)}
+        self.axes['sender'] = list(range(NB_IDS))
+        self.axes['receiver'] = list(range(NB_IDS))
+        self.axes['rssi_rank'] = list(range(RSSI_COLUMNS))
+        self.data = None
+
+    @property
+    def shape(self):
+        return tuple(len(self.axes[axis]) for axis in AXES)
+
+    def signature(self):
+        """
+        tells whether the consolidated file is still valid
+        """
+        return repr([(str(path), path.stat().st_mtime_ns)
+                     for path in self.runs.values()])
+
+    def matrix(self, settings):
+        """
+        the [NB_IDS, NB_IDS, RSSI_COLUMNS] array for one run,
+        all NaN if there is no such run
+        """
+        path = self.runs.get(tuple(settings))
+        if path is None:
+            return np.full((NB_IDS, NB_IDS, RSSI_COLUMNS), np.nan,
+                           dtype=np.float32)
+        if self.data is not None:
+            return self.data[tuple(self.axes[axis].index(value)
+                                   for axis, value in zip(RUN_AXES, settings))]
+        return rssi_matrix(path)
+
+    def select(self, **selection):
+        """
+        a sub-cube; each axis in AXES can be given either a single value,
+        or a list of values; axes that are not mentioned are kept whole
+
+        returns a tuple axes, values where axes is the list of the
+        remaining dimensions - the ones not given as a single value -
+        and values the corresponding array
+
+        only the runs involved get loaded
+        """
+        for axis in selection:
+            if axis not in AXES:
+                raise ValueError(f"unknown axis {axis}")
+        def chosen(axis):
+            value = selection.get(axis, self.axes[axis])
+            return value if isinstance(value, (list, tuple)) else [value]
+        run_values = [chosen(axis) for axis in RUN_AXES]
+        matrix_values = [chosen(axis) for axis in MATRIX_AXES]
+        matrix_index = np.ix_(*matrix_values)
+        shape = tuple(len(values) for values in run_values)
+        result = np.empty(shape + tuple(len(values) for values in matrix_values),
+                          dtype=np.float32)
+        for index in np.ndindex(*shape):
+            settings = tuple(values[i] for values, i in zip(run_values, index))
+            result[index] = self.matrix(settings)[matrix_index]
+        remaining = [axis for axis in AXES
+                     if isinstance(selection.get(axis, []), (list, tuple))]
+        # drop the dimensions given as a single value
+        squeezed = tuple(i for i, axis in enumerate(AXES)
+                         if axis not in remaining)
+        return remaining, result.squeeze(axis=squeezed)
+
+    def load(self):
+        """
+        loads the whole cube in memory, and returns it as an array
+        of shape self.shape; it is stored in a consolidated file
+        at the root of run_name, that is reused as long as
+        none of the RSSI.txt files change
+        """
+        if self.data is not None:
+            return self.data
+        signature = self.signature()
+        cube = self.run_name / CUBE
+        try:
+            with np.load(cube) as stored:
+                if str(stored['signature']) == signature:
+                    self.data = stored['data']
+                    return self.data
+        except (OSError, KeyError, ValueError):
+            pass
+        _, data = self.select()
+        try:
+            np.savez(cube, data=data, signature=np.array(signature),
+                     **{axis: np.array(self.axes[axis]) for axis in RUN_AXES})
+        except OSError:
+            pass
+        self.data = data
+        return data
+
+    def to_xarray(self):
+        """
+        the whole cube as an xarray DataArray - requires xarray
+        """
+        import xarray
+        return xarray.DataArray(self.load(), dims=AXES,
+                                coords={axis: self.axes[axis] for axis in AXES})